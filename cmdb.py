@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+cmdb.py
+多个批量脚本共用的 CMDB 读取与本地状态文件保存。
+
+CMDB 连接参数来自环境变量 CMDB_HOST / CMDB_PORT / CMDB_USER / CMDB_PASSWORD / CMDB_NAME，
+在调用时读取，调用方可以先 load_dotenv() 再使用。
+"""
+
+import json
+import os
+from typing import Any, Dict, List, Optional
+
+import pymysql
+
+
+def cmdb_config() -> Dict[str, Any]:
+    """CMDB（mysql_cluster / mysql_cluster_instance 所在库）的连接参数"""
+    return {
+        "host": os.getenv('CMDB_HOST', '192.168.0.10'),
+        "port": int(os.getenv('CMDB_PORT', '33306')),
+        "user": os.getenv('CMDB_USER', ''),
+        "password": os.getenv('CMDB_PASSWORD', ''),
+        "database": os.getenv('CMDB_NAME', 'test'),
+        "connect_timeout": 5,
+        "cursorclass": pymysql.cursors.DictCursor,
+    }
+
+
+def get_cmdb_clusters(config: Optional[Dict[str, Any]] = None) -> Dict[str, List[str]]:
+    """从 CMDB 读取 mysql_cluster 中所有集群及其在 mysql_cluster_instance 登记的实例 IP，
+    {cluster_name: [ip, ...]}，主库角色的实例排在最前。
+
+    config 为 pymysql.connect 参数（需使用 DictCursor），默认 cmdb_config()。
+    连接或查询失败时抛出 pymysql.MySQLError。
+    """
+    conn = pymysql.connect(**(config or cmdb_config()))
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT a.cluster_name, b.ip, b.instance_role FROM mysql_cluster_instance b "
+                           "JOIN mysql_cluster a ON a.cluster_name = b.cluster_name "
+                           "ORDER BY a.cluster_name, b.ip")
+            rows = cursor.fetchall()
+    finally:
+        conn.close()
+
+    clusters: Dict[str, List[str]] = {}
+    for row in rows:
+        ips = clusters.setdefault(row['cluster_name'], [])
+        if str(row['instance_role']).lower() == 'master':
+            ips.insert(0, row['ip'])
+        else:
+            ips.append(row['ip'])
+    return clusters
+
+
+def save_json_atomic(path: str, data: Any):
+    """先写 path.tmp 再 os.replace，进程中途退出也不会留下写了一半的文件"""
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, default=str)
+    os.replace(tmp, path)
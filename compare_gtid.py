@@ -3,13 +3,18 @@
 compare_gtid.py
 用法示例:
   python3 compare_gtid.py 192.168.0.10 192.168.0.11
+  python3 compare_gtid.py --cluster 192.168.0.10,192.168.0.11,192.168.0.12 --primary 192.168.0.10
 """
 
 import argparse
 import pymysql
 import sys
 import os
-from typing import Dict, List, Tuple
+import re
+from array import array
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
 
 # 使用 python-dotenv 从 .env 文件加载凭据（可选）
 try:
@@ -24,60 +29,61 @@ DEFAULT_USER = os.getenv('MYSQL_USER', '')
 DEFAULT_PASSWORD = os.getenv('MYSQL_PASSWORD', '')
 DEFAULT_PORT = int(os.getenv('MYSQL_PORT', '3306'))
 
+# 集群模式并发连接数上限
+MAX_FETCH_WORKERS = 32
+
 Interval = Tuple[int, int]
 GTIDMap = Dict[str, List[Interval]]
 
 
-def parse_gtid_set(gtid: str) -> GTIDMap:
-    """解析 GTID_EXECUTED 字符串为 {uuid: [(start,end), ...], ...} 并合并区间。"""
-    result: GTIDMap = {}
-    if not gtid:
-        return result
+# 单个区间 token：N 或 N-M，前后以 ':' 或 part 结尾为界（endpos 处 $ 可匹配）
+_INTERVAL_RE = re.compile(r':\s*(\d+)(?:\s*-\s*(\d+))?\s*(?=:|$)')
 
-    gtid = gtid.strip()
-    if gtid == "":
-        return result
 
-    # 每个 source 的部分以逗号分隔
-    parts = [p.strip() for p in gtid.split(',') if p.strip()]
-    for part in parts:
-        # 格式: uuid:interval[:interval...]
-        segs = part.split(':')
-        if len(segs) < 2:
-            # 可能是仅 uuid（不太可能），跳过
-            continue
-        uuid = segs[0]
-        intervals_tokens = segs[1:]
-        intervals: List[Interval] = []
-        for tok in intervals_tokens:
-            if tok == '':
-                continue
-            if '-' in tok:
-                a, b = tok.split('-', 1)
-                try:
-                    start = int(a)
-                    end = int(b)
-                except ValueError:
-                    continue
-            else:
-                try:
-                    start = end = int(tok)
-                except ValueError:
-                    continue
-            intervals.append((start, end))
+def iter_gtid_intervals(gtid: str) -> Iterator[Tuple[str, int, int]]:
+    """按出现顺序逐个产出 (uuid, start, end)。
 
-        if not intervals:
-            continue
+    直接在原字符串上用 find/finditer 按位置扫描，不为每个 part 和 token 生成中间列表；
+    无法解析的 token（例如 8.4 的 tag）跳过。
+    """
+    if not gtid:
+        return
+    pos, n = 0, len(gtid)
+    while pos < n:
+        comma = gtid.find(',', pos)
+        if comma < 0:
+            comma = n
+        colon = gtid.find(':', pos, comma)
+        if colon >= 0:
+            uuid = gtid[pos:colon].strip()
+            if uuid:
+                for m in _INTERVAL_RE.finditer(gtid, colon, comma):
+                    start = int(m.group(1))
+                    end = start if m.group(2) is None else int(m.group(2))
+                    yield uuid, start, end
+        pos = comma + 1
 
-        # 合并区间
-        merged = merge_intervals(intervals)
-        if uuid in result:
-            # 合并已有与新解析到的区间
-            combined = merge_intervals(result[uuid] + merged)
-            result[uuid] = combined
-        else:
-            result[uuid] = merged
 
+def parse_gtid_set(gtid: str) -> GTIDMap:
+    """解析 GTID_EXECUTED 字符串为 {uuid: [(start,end), ...], ...} 并合并区间。
+
+    MySQL 输出的区间本身已有序且不相邻，只有乱序、重叠或 uuid 重复出现时才需要再合并。
+    """
+    result: GTIDMap = {}
+    unsorted = set()
+    last_uuid, last = None, None
+    for uuid, start, end in iter_gtid_intervals(gtid):
+        if uuid != last_uuid:
+            last = result.get(uuid)
+            if last is None:
+                last = result[uuid] = []
+            last_uuid = uuid
+        if last and start <= last[-1][1] + 1:
+            unsorted.add(uuid)
+        last.append((start, end))
+
+    for uuid in unsorted:
+        result[uuid] = merge_intervals(result[uuid])
     return result
 
 
@@ -178,9 +184,205 @@ def compare_gtid_maps(source_map: GTIDMap, replica_map: GTIDMap) -> Tuple[GTIDMa
     return source_only, replica_only
 
 
-def fetch_gtid(host: str, user: str, password: str, port: int) -> str:
+class GtidSet:
+    """GTID 集合，支持集合运算。
+
+    每个 uuid 的区间按起点排序、互不重叠也不相邻，起点和终点分别存放在两个
+    array('q') 中（每个区间 16 字节，远小于 tuple 列表）。contains 用 bisect 查找，
+    并、交、差和子集判断都是对两个有序区间序列的线性归并。uuid 统一转为小写，
+    因此只是格式（大小写、顺序、换行、区间拆分）不同的 gtid_executed 比较结果相等。
+    """
+
+    __slots__ = ('_sets',)
+
+    def __init__(self, gtidmap: Optional[GTIDMap] = None):
+        # {uuid: (starts, ends)}，空区间的 uuid 不保存
+        self._sets: Dict[str, Tuple[array, array]] = {}
+        for uuid, intervals in (gtidmap or {}).items():
+            merged = merge_intervals(intervals)
+            if merged:
+                self._put(uuid.lower(), _to_arrays(merged), merge=True)
+
+    @classmethod
+    def parse(cls, gtid: str) -> 'GtidSet':
+        """解析 gtid_executed / gtid_purged 格式的字符串"""
+        # parse_gtid_set 的结果已合并，直接转存为 array，不再重复排序
+        result = cls()
+        for uuid, intervals in parse_gtid_set(gtid).items():
+            result._put(uuid.lower(), _to_arrays(intervals), merge=True)
+        return result
+
+    def _put(self, uuid: str, arrays: Tuple[array, array], merge: bool = False):
+        if merge and uuid in self._sets:
+            arrays = _union(self._sets[uuid], arrays)
+        if arrays[0]:
+            self._sets[uuid] = arrays
+
+    def to_map(self) -> GTIDMap:
+        return {uuid: list(zip(starts, ends)) for uuid, (starts, ends) in self._sets.items()}
+
+    def uuids(self) -> List[str]:
+        return sorted(self._sets)
+
+    def intervals(self, uuid: str) -> List[Interval]:
+        starts, ends = self._sets.get(uuid.lower(), (array('q'), array('q')))
+        return list(zip(starts, ends))
+
+    def count(self, uuid: Optional[str] = None) -> int:
+        """集合中的事务总数，指定 uuid 时只统计该 uuid"""
+        if uuid is not None:
+            starts, ends = self._sets.get(uuid.lower(), (array('q'), array('q')))
+            return sum(ends) - sum(starts) + len(starts)
+        return sum(sum(ends) - sum(starts) + len(starts) for starts, ends in self._sets.values())
+
+    def contains(self, uuid: str, gno: int) -> bool:
+        arrays = self._sets.get(uuid.lower())
+        if not arrays:
+            return False
+        starts, ends = arrays
+        i = bisect_right(starts, gno) - 1
+        return i >= 0 and ends[i] >= gno
+
+    def union(self, other: 'GtidSet') -> 'GtidSet':
+        result = GtidSet()
+        for uuid in set(self._sets) | set(other._sets):
+            a, b = self._sets.get(uuid), other._sets.get(uuid)
+            result._put(uuid, _union(a, b) if a and b else (a or b))
+        return result
+
+    def intersection(self, other: 'GtidSet') -> 'GtidSet':
+        result = GtidSet()
+        for uuid in set(self._sets) & set(other._sets):
+            result._put(uuid, _intersection(self._sets[uuid], other._sets[uuid]))
+        return result
+
+    def difference(self, other: 'GtidSet') -> 'GtidSet':
+        result = GtidSet()
+        for uuid, a in self._sets.items():
+            b = other._sets.get(uuid)
+            result._put(uuid, _difference(a, b) if b else a)
+        return result
+
+    def is_subset(self, other: 'GtidSet') -> bool:
+        for uuid, a in self._sets.items():
+            b = other._sets.get(uuid)
+            if not b or not _is_subset(a, b):
+                return False
+        return True
+
+    __or__ = union
+    __and__ = intersection
+    __sub__ = difference
+    __le__ = is_subset
+
+    def __contains__(self, gtid: str) -> bool:
+        uuid, gno = gtid.rsplit(':', 1)
+        return self.contains(uuid, int(gno))
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, GtidSet):
+            return NotImplemented
+        return self._sets == other._sets
+
+    def __bool__(self) -> bool:
+        return bool(self._sets)
+
+    def __str__(self) -> str:
+        # 按 uuid 排序，格式 uuid:interval:interval,...
+        return ','.join(f"{uuid}:{intervals_to_str(zip(*self._sets[uuid]))}" for uuid in sorted(self._sets))
+
+    def __repr__(self) -> str:
+        return f"GtidSet({str(self)!r})"
+
+
+def _to_arrays(intervals: List[Interval]) -> Tuple[array, array]:
+    return array('q', (s for s, _ in intervals)), array('q', (e for _, e in intervals))
+
+
+def _union(a: Tuple[array, array], b: Tuple[array, array]) -> Tuple[array, array]:
+    """两个有序区间序列的并集，线性归并并合并重叠/相邻区间"""
+    a_starts, a_ends = a
+    b_starts, b_ends = b
+    starts, ends = array('q'), array('q')
+    i = j = 0
+    while i < len(a_starts) or j < len(b_starts):
+        if j >= len(b_starts) or (i < len(a_starts) and a_starts[i] <= b_starts[j]):
+            s, e = a_starts[i], a_ends[i]
+            i += 1
+        else:
+            s, e = b_starts[j], b_ends[j]
+            j += 1
+        if ends and s <= ends[-1] + 1:
+            if e > ends[-1]:
+                ends[-1] = e
+        else:
+            starts.append(s)
+            ends.append(e)
+    return starts, ends
+
+
+def _intersection(a: Tuple[array, array], b: Tuple[array, array]) -> Tuple[array, array]:
+    a_starts, a_ends = a
+    b_starts, b_ends = b
+    starts, ends = array('q'), array('q')
+    i = j = 0
+    while i < len(a_starts) and j < len(b_starts):
+        s = max(a_starts[i], b_starts[j])
+        e = min(a_ends[i], b_ends[j])
+        if s <= e:
+            starts.append(s)
+            ends.append(e)
+        if a_ends[i] < b_ends[j]:
+            i += 1
+        else:
+            j += 1
+    return starts, ends
+
+
+def _difference(a: Tuple[array, array], b: Tuple[array, array]) -> Tuple[array, array]:
+    a_starts, a_ends = a
+    b_starts, b_ends = b
+    starts, ends = array('q'), array('q')
+    j = 0
+    for s, e in zip(a_starts, a_ends):
+        while j < len(b_starts) and b_ends[j] < s:
+            j += 1
+        k = j
+        while k < len(b_starts) and b_starts[k] <= e:
+            if b_starts[k] > s:
+                starts.append(s)
+                ends.append(b_starts[k] - 1)
+            s = max(s, b_ends[k] + 1)
+            if s > e:
+                break
+            k += 1
+        if s <= e:
+            starts.append(s)
+            ends.append(e)
+    return starts, ends
+
+
+def _is_subset(a: Tuple[array, array], b: Tuple[array, array]) -> bool:
+    a_starts, a_ends = a
+    b_starts, b_ends = b
+    j = 0
+    for s, e in zip(a_starts, a_ends):
+        # b 中区间互不相邻，a 的一个区间只能被 b 的某一个区间完整覆盖
+        while j < len(b_starts) and b_ends[j] < s:
+            j += 1
+        if j >= len(b_starts) or b_starts[j] > s or b_ends[j] < e:
+            return False
+    return True
+
+
+def connect(host: str, user: str, password: str, port: int):
+    return pymysql.connect(host=host, user=user, password=password, port=port, connect_timeout=5)
+
+
+def query_gtid(host: str, user: str, password: str, port: int) -> str:
+    """读取 gtid_executed，连接或查询失败时抛出 pymysql.MySQLError"""
+    conn = connect(host, user, password, port)
     try:
-        conn = pymysql.connect(host=host, user=user, password=password, port=port, connect_timeout=5)
         with conn.cursor() as cur:
             cur.execute("SELECT @@GLOBAL.gtid_executed")
             row = cur.fetchone()
@@ -189,9 +391,6 @@ def fetch_gtid(host: str, user: str, password: str, port: int) -> str:
             # row may be a tuple
             val = row[0] if isinstance(row, (list, tuple)) else row
             return val if val is not None else ''
-    except pymysql.MySQLError as e:
-        print(f"连接 {host} 时出错: {e}")
-        sys.exit(2)
     finally:
         try:
             conn.close()
@@ -199,47 +398,309 @@ def fetch_gtid(host: str, user: str, password: str, port: int) -> str:
             pass
 
 
+def fetch_gtid(host: str, user: str, password: str, port: int) -> str:
+    try:
+        return query_gtid(host, user, password, port)
+    except pymysql.MySQLError as e:
+        print(f"连接 {host} 时出错: {e}")
+        sys.exit(2)
+
+
+def fetch_gtids(hosts: List[str], user: str, password: str, port: int,
+                max_workers: int = MAX_FETCH_WORKERS,
+                primary: Optional[str] = None) -> Tuple[Dict[str, str], Dict[str, str]]:
+    """并发读取多台实例的 gtid_executed，返回 ({host: gtid}, {host: 错误信息})。
+
+    总耗时约等于最慢的一次连接，而不是逐台累加。指定 primary 时先并发读完其余实例，
+    最后再读主库：主库在持续写入时，这样主库的快照一定包含备库已复制的全部事务，
+    备库上刚复制过来的主库事务不会被误判为 errant。
+    """
+    gtids: Dict[str, str] = {}
+    errors: Dict[str, str] = {}
+    others = [host for host in hosts if host != primary]
+    if others:
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(others)))) as pool:
+            futures = {host: pool.submit(query_gtid, host, user, password, port) for host in others}
+            for host, future in futures.items():
+                try:
+                    gtids[host] = future.result()
+                except pymysql.MySQLError as e:
+                    errors[host] = str(e)
+    if primary is not None and primary in hosts:
+        try:
+            gtids[primary] = query_gtid(primary, user, password, port)
+        except pymysql.MySQLError as e:
+            errors[primary] = str(e)
+    return gtids, errors
+
+
+def compare_cluster(gtid_sets: Dict[str, GtidSet],
+                    primary: str) -> Tuple[GtidSet, Dict[str, Dict[str, GtidSet]]]:
+    """一次遍历算出每台实例相对全体并集和相对主库的缺失/多出事务。
+
+    返回 (全体并集, report)，report 为 {host: {'missing_union', 'errant_union', 'missing_primary', 'errant_primary'}}：
+      missing_union   并集中有而该实例没有的事务
+      errant_union    只有该实例执行过、其他实例都没有的事务
+      missing_primary 主库有而该实例没有的事务（复制延迟或缺失）
+      errant_primary  该实例有而主库没有的事务（errant transaction）
+    """
+    hosts = list(gtid_sets)
+    # 前缀/后缀并集，errant_union 无需为每台实例重新求其余实例的并集
+    prefix = [GtidSet()]
+    for host in hosts:
+        prefix.append(prefix[-1] | gtid_sets[host])
+    suffix = [GtidSet()]
+    for host in reversed(hosts):
+        suffix.append(suffix[-1] | gtid_sets[host])
+    suffix.reverse()
+
+    union = prefix[-1]
+    primary_set = gtid_sets[primary]
+    report: Dict[str, Dict[str, GtidSet]] = {}
+    for i, host in enumerate(hosts):
+        gtid_set = gtid_sets[host]
+        others = prefix[i] | suffix[i + 1]
+        report[host] = {
+            'missing_union': union - gtid_set,
+            'errant_union': gtid_set - others,
+            'missing_primary': primary_set - gtid_set,
+            'errant_primary': gtid_set - primary_set,
+        }
+    return union, report
+
+
+def print_cluster_report(report: Dict[str, Dict[str, GtidSet]], primary: str):
+    labels = [
+        ('missing_union', '相对并集缺失'),
+        ('errant_union', '仅本实例存在'),
+        ('missing_primary', '相对主库缺失'),
+        ('errant_primary', '主库不存在(errant)'),
+    ]
+    for host, diff in report.items():
+        role = '主库' if host == primary else '备库'
+        if not any(diff.values()):
+            print(f"\n[{host}] ({role}) 与所有实例一致")
+            continue
+        print(f"\n[{host}] ({role})")
+        for key, label in labels:
+            if key == 'missing_primary' and host == primary:
+                continue
+            gtid_set = diff[key]
+            if gtid_set:
+                print(f"  {label} ({gtid_set.count()} 个事务):")
+                for uuid in gtid_set.uuids():
+                    print(f"    {uuid}:{intervals_to_str(gtid_set.intervals(uuid))}")
+
+
+def run_cluster(hosts: List[str], primary: str, user: str, password: str, port: int) -> int:
+    """集群模式：并发拉取所有实例的 GTID 并一次性比较，返回退出码"""
+    gtids, errors = fetch_gtids(hosts, user, password, port, primary=primary)
+    for host, err in errors.items():
+        print(f"连接 {host} 时出错: {err}")
+    if primary in errors:
+        print(f"主库 {primary} 无法连接，放弃比较")
+        return 2
+
+    gtid_sets = {host: GtidSet.parse(gtids[host]) for host in hosts if host in gtids}
+    union, report = compare_cluster(gtid_sets, primary)
+    consistent = not any(any(diff.values()) for diff in report.values())
+    print(f"共 {len(hosts)} 台实例，主库 {primary}，并集 {union.count()} 个事务")
+    print_cluster_report(report, primary)
+    if consistent:
+        print("\n所有可连接实例 GTID 集合相同")
+    return 2 if errors else 0
+
+
+class BinlogLocator:
+    """在主库现存 binlog 中定位包含某个 GTID 的文件。
+
+    每个 binlog 开头的 Previous_gtids 事件记录了此前所有文件执行过的 GTID，
+    随文件序号单调增长，因此 "GTID 在第 i 个文件中" 等价于
+    "不在 Previous_gtids(i) 中但在 Previous_gtids(i+1) 中"（最后一个文件用 gtid_executed 代替）。
+    对 SHOW BINARY LOGS 的文件列表二分，每次定位只需读取 O(log N) 个文件头，
+    读过的 Previous_gtids 会缓存，定位多个 GTID 时复用。
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        with conn.cursor() as cur:
+            cur.execute("SHOW BINARY LOGS")
+            self.files: List[str] = [row[0] for row in cur.fetchall()]
+            cur.execute("SELECT @@GLOBAL.gtid_executed")
+            row = cur.fetchone()
+        self.executed = GtidSet.parse((row[0] if row else '') or '')
+        self._previous: Dict[str, GtidSet] = {}
+
+    def previous_gtids(self, index: int) -> GtidSet:
+        """第 index 个文件的 Previous_gtids，index == len(files) 时返回 gtid_executed"""
+        if index >= len(self.files):
+            return self.executed
+        name = self.files[index]
+        if name not in self._previous:
+            # 文件头依次是 Format_desc、Previous_gtids，LIMIT 足够覆盖
+            with self.conn.cursor() as cur:
+                cur.execute(f"SHOW BINLOG EVENTS IN '{name}' LIMIT 3")
+                rows = cur.fetchall()
+            info = next((row[5] for row in rows if row[2] == 'Previous_gtids'), '')
+            self._previous[name] = GtidSet.parse(info or '')
+        return self._previous[name]
+
+    def locate(self, uuid: str, gno: int) -> Optional[str]:
+        """返回包含该 GTID 的 binlog 文件名；已被 purge 或主库未执行过时返回 None"""
+        if not self.files or not self.executed.contains(uuid, gno):
+            return None
+        # 找到最小的 j 使 Previous_gtids(j) 包含该 GTID，所在文件为 j-1
+        lo, hi = 0, len(self.files)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.previous_gtids(mid).contains(uuid, gno):
+                hi = mid
+            else:
+                lo = mid + 1
+        if lo == 0:
+            return None
+        return self.files[lo - 1]
+
+    def locate_set(self, gtid_set: GtidSet) -> Dict[str, Optional[str]]:
+        """对每个 uuid 定位其最小缺失 GTID 所在文件，即该 uuid 需要从哪个文件开始回放"""
+        return {uuid: self.locate(uuid, gtid_set.intervals(uuid)[0][0]) for uuid in gtid_set.uuids()}
+
+
+def print_locations(locator: BinlogLocator, missing: GtidSet, host: str):
+    locations = locator.locate_set(missing)
+    print(f"\n缺失 GTID 在 {host} binlog 中的起始位置:")
+    for uuid, name in locations.items():
+        first = missing.intervals(uuid)[0][0]
+        print(f"  {uuid}:{first} -> {name or '不在现存 binlog 中（已 purge）'}")
+    found = [name for name in locations.values() if name]
+    if found:
+        print(f"最早需要的 binlog 文件: {min(found, key=locator.files.index)}")
+
+
+def check_auto_position(source_executed: GtidSet, source_purged: GtidSet, replica_executed: GtidSet,
+                        source_uuid: str = '') -> Dict:
+    """判断备库能否用 MASTER_AUTO_POSITION=1 从主库增量追平。
+
+    source_executed / source_purged 必须在 replica_executed 之后读取，否则主库持续写入时
+    备库已复制的主库事务会被当作 errant。
+
+    主库需要发送 source_executed - replica_executed，只要其中有事务落在
+    gtid_purged 中，binlog 已不存在，START SLAVE 会报 1236，只能重建。
+    备库多出的事务（errant）不会被主库发送，一般不影响追平；但若 errant 使用了主库的
+    server_uuid，主库会直接拒绝该备库（同样是 1236）。
+    """
+    missing = source_executed - replica_executed
+    purged_missing = missing & source_purged
+    errant = replica_executed - source_executed
+    source_uuid = source_uuid.lower()
+    errant_with_source_uuid = bool(source_uuid) and source_uuid in errant.uuids()
+    return {
+        'feasible': not purged_missing and not errant_with_source_uuid,
+        'missing': missing,
+        'purged_missing': purged_missing,
+        'errant': errant,
+        'errant_with_source_uuid': errant_with_source_uuid,
+    }
+
+
+def print_auto_position(result: Dict, source: str, replica: str):
+    print(f"\nauto-position 可行性检查 ({source} -> {replica}):")
+    print(f"  需要补齐的事务: {result['missing'].count()}")
+    if result['purged_missing']:
+        print(f"  其中已在主库 purge 的事务 ({result['purged_missing'].count()} 个):")
+        for uuid in result['purged_missing'].uuids():
+            print(f"    {uuid}:{intervals_to_str(result['purged_missing'].intervals(uuid))}")
+    if result['errant']:
+        print(f"  备库多出的事务 (errant): {result['errant']}")
+        if result['errant_with_source_uuid']:
+            print("  errant 事务使用了主库 server_uuid，主库会拒绝该备库")
+    if result['feasible']:
+        print("结论: 可以通过 auto-position 增量追平，无需重建")
+    else:
+        print("结论: 无法通过 auto-position 追平，需要重建备库")
+
+
 def main():
-    parser = argparse.ArgumentParser(description="比较两个 MySQL 8.0 实例的 GTID_EXECUTED")
-    parser.add_argument("source", help="主库 IP")
-    parser.add_argument("replica", help="备库 IP")
+    parser = argparse.ArgumentParser(description="比较 MySQL 8.0 实例的 GTID_EXECUTED")
+    parser.add_argument("source", nargs='?', help="主库 IP")
+    parser.add_argument("replica", nargs='?', help="备库 IP")
+    parser.add_argument("--cluster", help="集群模式：逗号分隔的所有成员 IP，并发拉取并一次性比较")
+    parser.add_argument("--primary", help="集群模式下作为基准的主库 IP，默认 --cluster 中第一个")
+    parser.add_argument("--locate", action="store_true",
+                        help="二分查找主库 binlog，定位备库缺失 GTID 所在的文件")
+    parser.add_argument("--check-auto-position", action="store_true",
+                        help="对照主库 gtid_purged 判断备库能否用 auto-position 追平，还是必须重建")
     parser.add_argument("--user", default=DEFAULT_USER, help="MySQL 用户，默认为空")
     parser.add_argument("--password", default=DEFAULT_PASSWORD, help="MySQL 密码,默认为空")
     parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="MySQL 端口，默认 3306")
     args = parser.parse_args()
 
+    if args.cluster:
+        hosts = list(dict.fromkeys(h.strip() for h in args.cluster.split(',') if h.strip()))
+        primary = args.primary or (hosts[0] if hosts else None)
+        if not primary:
+            parser.error("--cluster 至少需要一个 IP")
+        if primary not in hosts:
+            hosts.insert(0, primary)
+        sys.exit(run_cluster(hosts, primary, args.user, args.password, args.port))
+
+    if not args.source or not args.replica:
+        parser.error("需要指定 source 和 replica，或使用 --cluster")
+
     pwd = args.password
 
-    source_gtid = fetch_gtid(args.source, args.user, pwd, args.port)
+    # 先读备库再读主库：主库持续写入时，主库快照一定包含备库已复制的事务，
+    # 不会把备库刚复制到的主库事务误判为 errant
     replica_gtid = fetch_gtid(args.replica, args.user, pwd, args.port)
+    source_gtid = fetch_gtid(args.source, args.user, pwd, args.port)
 
     print(f"主库 GTID_EXECUTED:\n{source_gtid}")
     print(f"备库 GTID_EXECUTED:\n{replica_gtid}")
 
-    m_map = parse_gtid_set(source_gtid)
-    r_map = parse_gtid_set(replica_gtid)
+    source_set = GtidSet.parse(source_gtid)
+    replica_set = GtidSet.parse(replica_gtid)
 
     # 归一化并比较
-    if gtidmap_to_canonical(m_map) == gtidmap_to_canonical(r_map):
+    if source_set == replica_set:
         print("GTID 集合相同")
         sys.exit(0)
 
-    source_only, replica_only = compare_gtid_maps(m_map, r_map)
+    source_only = source_set - replica_set
+    replica_only = replica_set - source_set
 
     print(f"\nsource:{args.source} 中存在但 Replica:{args.replica} 中不存在的 GTID:")
     if source_only:
-        for uuid in sorted(source_only.keys()):
-            print(f"{uuid}:{intervals_to_str(source_only[uuid])}")
+        for uuid in source_only.uuids():
+            print(f"{uuid}:{intervals_to_str(source_only.intervals(uuid))}")
     else:
         print("（无）")
 
-    print("\nReplica:{args.replica} 中存在但 source:{args.source} 中不存在的 GTID:")
+    print(f"\nReplica:{args.replica} 中存在但 source:{args.source} 中不存在的 GTID:")
     if replica_only:
-        for uuid in sorted(replica_only.keys()):
-            print(f"{uuid}:{intervals_to_str(replica_only[uuid])}")
+        for uuid in replica_only.uuids():
+            print(f"{uuid}:{intervals_to_str(replica_only.intervals(uuid))}")
     else:
         print("（无）")
 
+    if (args.locate and source_only) or args.check_auto_position:
+        try:
+            conn = connect(args.source, args.user, pwd, args.port)
+            try:
+                if args.check_auto_position:
+                    # 主库的 gtid_executed/gtid_purged 在读完备库之后一起重新读取，保证是备库的超集
+                    with conn.cursor() as cur:
+                        cur.execute("SELECT @@GLOBAL.gtid_executed, @@GLOBAL.gtid_purged, @@GLOBAL.server_uuid")
+                        executed, purged, server_uuid = cur.fetchone()
+                    result = check_auto_position(GtidSet.parse(executed or ''), GtidSet.parse(purged or ''),
+                                                 replica_set, server_uuid or '')
+                    print_auto_position(result, args.source, args.replica)
+                if args.locate and source_only:
+                    print_locations(BinlogLocator(conn), source_only, args.source)
+            finally:
+                conn.close()
+        except pymysql.MySQLError as e:
+            print(f"查询 {args.source} 时出错: {e}")
+
     sys.exit(0)
 
 
@@ -1,13 +1,11 @@
 import argparse
-import etcd3
 import json
 import subprocess
-from etcd3 import Etcd3Client
+
+from ha_meta import DEFAULT_BACKEND, HaMetaError, open_backend
 
 
 # SERVER = '192.168.0.10'
-ETCD_SERVER = "127.0.0.1"
-ips = etcd3.client(host=ETCD_SERVER, port=2379)
 
 
 def mysql_ping_ok(ip):
@@ -67,15 +65,25 @@ def main():
         type=str,
         help="必传参数，用于指定查询的 arbit_server 键",
     )
+    parser.add_argument(
+        "--backend",
+        default=DEFAULT_BACKEND,
+        help=f"HA 元数据后端（etcd://、http://、file://），默认 {DEFAULT_BACKEND}",
+    )
     args = parser.parse_args()
 
     # 使用传入的 arbit_server 参数
     key = f"/db/ha/{args.arbit_server}"
-    for cluster, _ in ips.get_prefix(key):
+    try:
+        entries, _ = open_backend(args.backend).get_prefix(key)
+    except HaMetaError as e:
+        print(f"读取 {key} 失败: {e}")
+        return
+    for entry in entries:
         try:
-            downgrade(cluster)
+            downgrade(entry.value)
         except Exception as e:
-            print(f"Error decoding JSON for key {cluster}: {e}")
+            print(f"Error decoding JSON for key {entry.key}: {e}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+gtid_bench.py
+compare_gtid.py 中 GTID 解析与区间运算的基准测试，超过阈值时以退出码 1 结束，
+可放进 CI 或改动 compare_gtid.py 后手动运行，防止性能回退。
+
+用法示例:
+  python3 gtid_bench.py                          # 默认 1000 个 uuid × 每个 10000 个区间
+  python3 gtid_bench.py --uuids 100 --repeat 1   # 快速跑一轮
+  python3 gtid_bench.py --tolerance 2            # 机器较慢时放宽阈值
+"""
+
+import argparse
+import sys
+import time
+import uuid
+from typing import Callable, Dict, List, Tuple
+
+from compare_gtid import (GtidSet, gtidmap_to_canonical, merge_intervals,
+                          parse_gtid_set, subtract_intervals)
+
+# 阈值：每个区间的耗时上限（微秒），约为参考机器实测值的 3~5 倍
+THRESHOLDS_US = {
+    'parse_gtid_set': 4.0,
+    'GtidSet.parse': 4.0,
+    'merge_intervals': 1.0,
+    'subtract_intervals': 1.0,
+    'gtidmap_to_canonical': 0.6,
+}
+
+
+def build_gtid_string(uuids: int, intervals: int) -> str:
+    """生成 MySQL 格式的 gtid_executed：每个 uuid 的区间为 1-2:4-5:7-8:...，以 ',\\n' 分隔"""
+    parts = []
+    for i in range(uuids):
+        tokens = ':'.join(f"{3 * k + 1}-{3 * k + 2}" for k in range(intervals))
+        parts.append(f"{uuid.UUID(int=i + 1)}:{tokens}")
+    return ',\n'.join(parts)
+
+
+def best_of(func: Callable[[], object], repeat: int) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def run_benchmarks(gtid: str, repeat: int) -> Dict[str, Tuple[float, int]]:
+    """返回 {名称: (最佳耗时秒数, 处理的区间数)}"""
+    gtidmap = parse_gtid_set(gtid)
+    total = sum(len(v) for v in gtidmap.values())
+    # 减去每隔一个区间，使结果与输入规模相当
+    halves = {u: v[::2] for u, v in gtidmap.items()}
+    # merge_intervals 的输入打乱成逆序，覆盖排序和合并两部分
+    reversed_map = {u: v[::-1] for u, v in gtidmap.items()}
+
+    results: Dict[str, Tuple[float, int]] = {}
+    results['parse_gtid_set'] = (best_of(lambda: parse_gtid_set(gtid), repeat), total)
+    results['GtidSet.parse'] = (best_of(lambda: GtidSet.parse(gtid), repeat), total)
+    results['merge_intervals'] = (
+        best_of(lambda: [merge_intervals(v) for v in reversed_map.values()], repeat), total)
+    results['subtract_intervals'] = (
+        best_of(lambda: [subtract_intervals(v, halves[u]) for u, v in gtidmap.items()], repeat), total)
+    results['gtidmap_to_canonical'] = (best_of(lambda: gtidmap_to_canonical(gtidmap), repeat), total)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="GTID 解析与区间运算基准测试")
+    parser.add_argument("--uuids", type=int, default=1000, help="uuid 数量，默认 1000")
+    parser.add_argument("--intervals", type=int, default=10000, help="每个 uuid 的区间数，默认 10000")
+    parser.add_argument("--repeat", type=int, default=3, help="每项重复次数，取最好成绩，默认 3")
+    parser.add_argument("--tolerance", type=float, default=1.0, help="阈值放大倍数，默认 1.0")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    gtid = build_gtid_string(args.uuids, args.intervals)
+    print(f"生成 {args.uuids} 个 uuid × {args.intervals} 个区间，"
+          f"字符串 {len(gtid) / 1024 / 1024:.1f}MB，耗时 {time.perf_counter() - start:.2f}s")
+
+    results = run_benchmarks(gtid, max(1, args.repeat))
+
+    failed: List[str] = []
+    print(f"\n{'项目':<24}{'耗时(s)':>10}{'us/区间':>10}{'阈值':>10}  结果")
+    for name, (elapsed, total) in results.items():
+        per_interval = elapsed / max(total, 1) * 1e6
+        limit = THRESHOLDS_US[name] * args.tolerance
+        ok = per_interval <= limit
+        if not ok:
+            failed.append(name)
+        print(f"{name:<24}{elapsed:>10.3f}{per_interval:>10.3f}{limit:>10.2f}  {'OK' if ok else '超出阈值'}")
+
+    if failed:
+        print(f"\n性能回退: {', '.join(failed)}")
+        sys.exit(1)
+    print("\n全部在阈值内")
+    sys.exit(0)
+
+
+if __name__ == '__main__':
+    main()
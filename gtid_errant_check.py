@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+gtid_errant_check.py
+全量检查 CMDB 中每个集群的备库是否存在 errant 事务（主库上不存在的 GTID），适合放在 crontab 定时执行。
+
+每个集群并发读取所有成员的 gtid_executed，以主库为基准计算各备库的 errant 事务；
+结果保存在本地状态文件中。主库自身 server_uuid 的区间随写入不断增长，但不会产生 errant 事务，
+下次运行时除此之外的 gtid_executed 都未变化的集群直接复用上次结果，不再解析比较。
+存在 errant 事务时退出码为 1，便于告警。
+
+用法示例:
+  python3 gtid_errant_check.py
+  python3 gtid_errant_check.py --state /data/gtid_errant_state.json --output errant.ndjson
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import pymysql
+
+from cmdb import get_cmdb_clusters, save_json_atomic
+from compare_gtid import (DEFAULT_PASSWORD, DEFAULT_PORT, DEFAULT_USER, compare_gtid_maps, connect,
+                          fetch_gtids, gtidmap_to_canonical, parse_gtid_set)
+
+# 上次检查结果，供增量检查使用
+STATE_FILE = os.getenv('GTID_ERRANT_STATE', '/tmp/gtid_errant_state.json')
+
+
+def load_state(path: str) -> Dict[str, Dict]:
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f).get('clusters', {})
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        sys.stderr.write(f"状态文件 {path} 读取失败，全部重新检查: {e}\n")
+        return {}
+
+
+def save_state(path: str, state: Dict[str, Dict]):
+    """原子写回状态文件"""
+    save_json_atomic(path, {"version": 1, "saved_at": time.time(), "clusters": state})
+
+
+def query_primary(host: str, user: str, password: str, port: int) -> Tuple[str, Optional[str]]:
+    """确认 host 当前确实是主库，返回 (server_uuid, 不是主库的原因或 None)。
+
+    CMDB 中的 instance_role 在切换后可能过期，只有可写且未配置复制源的实例才作为比较基准。
+    """
+    conn = connect(host, user, password, port)
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT @@GLOBAL.server_uuid, @@GLOBAL.read_only")
+            server_uuid, read_only = cur.fetchone()
+            try:
+                cur.execute("SHOW REPLICA STATUS")
+            except pymysql.MySQLError:
+                cur.execute("SHOW SLAVE STATUS")
+            has_source = cur.fetchone() is not None
+    finally:
+        conn.close()
+    reason = "read_only=1" if int(read_only or 0) else "配置了复制源" if has_source else None
+    return (server_uuid or '').lower(), reason
+
+
+def fingerprint(ips: List[str], gtids: Dict[str, str], skip_uuid: str) -> str:
+    """按成员顺序对原始 gtid_executed 字符串求摘要，未变化时无需解析。
+
+    跳过 skip_uuid（主库 server_uuid）的区间：主库每次写入都会改变它，而备库先于主库读取，
+    这部分不可能是 errant 事务，计入摘要只会让繁忙集群的缓存永远失效。
+    """
+    h = hashlib.sha1()
+    for ip in ips:
+        gtid = gtids.get(ip)
+        if gtid is not None:
+            gtid = ','.join(part.strip() for part in gtid.split(',')
+                            if part.split(':', 1)[0].strip().lower() != skip_uuid)
+        h.update(f"{ip}={gtid}\n".encode())
+    return h.hexdigest()
+
+
+def check_cluster(name: str, ips: List[str], user: str, password: str, port: int,
+                  previous: Optional[Dict] = None) -> Dict:
+    """检查单个集群，ips[0] 为 CMDB 登记的主库。previous 为上次结果，指纹相同时直接复用。
+
+    先读完所有备库再读主库，主库持续写入时其快照包含备库已复制的全部事务。
+    ips[0] 不可写或配置了复制源时不做比较，记为 error。
+    """
+    primary = ips[0]
+    gtids, errors = fetch_gtids(ips, user, password, port, primary=primary)
+    record = {
+        "cluster": name,
+        "primary": primary,
+        "hosts": ips,
+        "unreachable": errors,
+        "checked_at": time.time(),
+    }
+    if primary in errors:
+        record.update(status="error", error=f"主库 {primary} 无法连接: {errors[primary]}",
+                      errant={}, fingerprint=None)
+        return record
+
+    try:
+        record['primary_uuid'], reason = query_primary(primary, user, password, port)
+    except pymysql.MySQLError as e:
+        reason = f"无法确认主库状态: {e}"
+    if reason:
+        record.update(status="error", error=f"CMDB 登记的主库 {primary} {reason}，不做比较",
+                      errant={}, fingerprint=None)
+        return record
+
+    digest = fingerprint(ips, gtids, record['primary_uuid'])
+    if previous and previous.get('fingerprint') == digest:
+        record.update(status=previous['status'], errant=previous['errant'], fingerprint=digest, cached=True)
+        return record
+
+    primary_map = parse_gtid_set(gtids[primary])
+    errant = {}
+    for ip in ips[1:]:
+        if ip not in gtids:
+            continue
+        _, replica_only = compare_gtid_maps(primary_map, parse_gtid_set(gtids[ip]))
+        if replica_only:
+            errant[ip] = gtidmap_to_canonical(replica_only)
+    record.update(status="errant" if errant else "ok", errant=errant, fingerprint=digest, cached=False)
+    return record
+
+
+def main():
+    parser = argparse.ArgumentParser(description="全量检查各集群备库的 errant 事务")
+    parser.add_argument("--state", default=STATE_FILE, help=f"上次检查结果的状态文件，默认 {STATE_FILE}")
+    parser.add_argument("--full", action="store_true", help="忽略状态文件，全部重新计算")
+    parser.add_argument("--parallel", type=int, default=8, help="并发检查的集群数，默认 8")
+    parser.add_argument("--output", help="逐集群输出 NDJSON 的文件，默认只打印汇总")
+    parser.add_argument("--user", default=DEFAULT_USER, help="MySQL 用户，默认为空")
+    parser.add_argument("--password", default=DEFAULT_PASSWORD, help="MySQL 密码,默认为空")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="MySQL 端口，默认 3306")
+    args = parser.parse_args()
+
+    clusters = get_cmdb_clusters()
+    previous = {} if args.full else load_state(args.state)
+
+    started = time.time()
+    with ThreadPoolExecutor(max_workers=max(1, args.parallel)) as pool:
+        futures = {name: pool.submit(check_cluster, name, ips, args.user, args.password, args.port,
+                                     previous.get(name))
+                   for name, ips in clusters.items() if ips}
+        results = {name: future.result() for name, future in futures.items()}
+
+    # 只保留 CMDB 中仍存在的集群，下线集群的旧结果随之清除
+    save_state(args.state, results)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as out:
+            for record in results.values():
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    errant_clusters = [r for r in results.values() if r['status'] == 'errant']
+    cached = sum(1 for r in results.values() if r.get('cached'))
+    for record in results.values():
+        if record['status'] == 'error':
+            print(f"[{record['cluster']}] {record['error']}")
+        for ip, err in record['unreachable'].items():
+            if ip != record['primary']:
+                print(f"[{record['cluster']}] 备库 {ip} 无法连接: {err}")
+    for record in errant_clusters:
+        print(f"[{record['cluster']}] 主库 {record['primary']}，存在 errant 事务:")
+        for ip, gtid in record['errant'].items():
+            print(f"  {ip}: {gtid}")
+
+    print(f"\n共检查 {len(results)} 个集群（{cached} 个未变化复用上次结果），"
+          f"{len(errant_clusters)} 个存在 errant 事务，耗时 {time.time() - started:.1f}s")
+    sys.exit(1 if errant_clusters else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -8,8 +8,20 @@
 
 import argparse
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import pymysql
-from pymysql.err import OperationalError
+
+from compare_gtid import GtidSet
+
+# 各阶段并发操作的实例数上限
+MAX_WORKERS = 32
+# 只读后 GTID 快照不一致时的重试间隔（秒）
+SNAPSHOT_RETRY_INTERVAL = 0.2
+# 等待备库追平时的轮询退避（秒）
+CATCHUP_INITIAL_BACKOFF = 0.5
+CATCHUP_MAX_BACKOFF = 5.0
 
 
 def parse_args():
@@ -22,6 +34,10 @@ def parse_args():
     p.add_argument("--replica-user", required=True, help="复制账号")
     p.add_argument("--replica-password", required=True, help="复制账号密码")
     p.add_argument("--dry-run", action="store_true", help="只检查一致性，不执行重置")
+    p.add_argument("--settle", type=float, default=5.0,
+                   help="只读后等待备库回放完在途事务、GTID 达到一致的最长秒数，默认 5")
+    p.add_argument("--catchup-timeout", type=float, default=300.0,
+                   help="恢复复制后等待所有备库 IO/SQL 线程运行且追平的最长秒数，默认 300，0 为不等待")
     return p.parse_args()
 
 
@@ -121,6 +137,91 @@ def restore_replication(slave_conn, slave_host, topo, repl_user, repl_password):
         print(f"[{slave_host}] 复制恢复失败: Slave_IO_Running={io_running}, Slave_SQL_Running={sql_running}, 错误={last_error}")
 
 
+def wait_for_catchup(conn, host, target, deadline):
+    """轮询单个备库直到 IO/SQL 线程均为 Yes 且追平（Seconds_Behind_Master=0 或已执行 target），
+    轮询间隔指数退避。返回 (是否追平, 耗时秒数, 最后状态说明)。
+    """
+    started = time.monotonic()
+    backoff = CATCHUP_INITIAL_BACKOFF
+    detail = ""
+    while True:
+        with conn.cursor() as cur:
+            cur.execute("SHOW SLAVE STATUS")
+            status = cur.fetchone()
+        if not status:
+            return False, time.monotonic() - started, "SHOW SLAVE STATUS 返回空"
+
+        io_running = status.get("Slave_IO_Running")
+        sql_running = status.get("Slave_SQL_Running")
+        lag = status.get("Seconds_Behind_Master")
+        if sql_running == "No" and status.get("Last_SQL_Error"):
+            # SQL 线程报错停止后不会自行恢复，无需等到超时
+            return False, time.monotonic() - started, f"SQL 线程错误: {status.get('Last_SQL_Error')}"
+        if io_running == "Yes" and sql_running == "Yes":
+            executed = GtidSet.parse(status.get("Executed_Gtid_Set") or "")
+            if lag == 0 or target <= executed:
+                return True, time.monotonic() - started, "已追平"
+        detail = (f"Slave_IO_Running={io_running}, Slave_SQL_Running={sql_running}, "
+                  f"Seconds_Behind_Master={lag}, 错误={status.get('Last_IO_Error') or status.get('Last_SQL_Error')}")
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False, time.monotonic() - started, f"超时: {detail}"
+        time.sleep(min(backoff, remaining))
+        backoff = min(backoff * 2, CATCHUP_MAX_BACKOFF)
+
+
+def run_parallel(hosts, func):
+    """对每个 host 并发执行 func(host)，全部结束后返回 ({host: 结果}, {host: 异常})。
+
+    调用返回即代表所有 host 都完成了这一阶段，作为阶段之间的屏障。
+    """
+    results, errors = {}, {}
+    if not hosts:
+        return results, errors
+    with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(hosts))) as pool:
+        futures = {host: pool.submit(func, host) for host in hosts}
+        for host, future in futures.items():
+            try:
+                results[host] = future.result()
+            except Exception as e:
+                errors[host] = e
+    return results, errors
+
+
+def take_gtid_snapshot(conns, settle):
+    """在全部实例只读后读取 gtid_executed，直到各实例一致或超过 settle 秒。
+
+    备库的 SQL 线程不受 read_only 限制，设置只读前已写入主库的事务可能仍在回放，
+    因此不一致时短暂重试，而不是立即判定失败。
+    """
+    deadline = time.monotonic() + settle
+    while True:
+        gtid_map, errors = run_parallel(list(conns), lambda h: get_gtid_executed(conns[h]))
+        if errors:
+            return gtid_map, None, errors
+        gtid_sets = {host: GtidSet.parse(gtid) for host, gtid in gtid_map.items()}
+        first = next(iter(gtid_sets.values()))
+        if all(gtid_set == first for gtid_set in gtid_sets.values()):
+            return gtid_map, gtid_sets, {}
+        if time.monotonic() >= deadline:
+            return gtid_map, gtid_sets, {}
+        time.sleep(SNAPSHOT_RETRY_INTERVAL)
+
+
+def restore_read_only(conns, original_ro):
+    def restore(host):
+        ro = original_ro[host]
+        set_read_only(conns[host], ro["read_only"])
+        print(f"[{host}] 恢复 read_only={ro['read_only']}, super_read_only={ro['super_read_only']}")
+    return run_parallel([h for h in conns if h in original_ro], restore)
+
+
+def report_errors(phase, errors):
+    for host, e in errors.items():
+        print(f"[{host}] {phase}失败: {e}")
+
+
 def main():
     args = parse_args()
     hosts = [h.strip() for h in args.hosts.split(",") if h.strip()]
@@ -128,82 +229,135 @@ def main():
         print("请至少提供一个 MySQL IP")
         sys.exit(1)
 
-    print("开始检查 GTID 一致性...")
-    gtid_map = {}
     conns = {}
-    topology = {}
+    fence_start = fence_end = None
     try:
-        for host in hosts:
-            try:
-                conn = connect(host, args.port, args.user, args.password)
-                conns[host] = conn
-            except OperationalError as e:
-                print(f"[{host}] 连接失败: {e}")
-                sys.exit(1)
-            gtid_map[host] = get_gtid_executed(conn)
-            print(f"[{host}] GTID_EXECUTED={gtid_map[host]}")
-
-            topo = get_slave_topology(conn, host)
+        # 阶段1：并发连接并读取复制拓扑、原只读状态
+        conns, errors = run_parallel(hosts, lambda h: connect(h, args.port, args.user, args.password))
+        if errors:
+            report_errors("连接", errors)
+            sys.exit(1)
+
+        def inspect(host):
+            topo = get_slave_topology(conns[host], host)
             if topo:
-                topology[host] = topo
                 print(f"[{host}] 当前复制源 {topo['master_host']}:{topo['master_port']}")
             else:
                 print(f"[{host}] 当前未配置从库，不恢复上游复制")
+            return topo, get_read_only_status(conns[host])
 
-        values = set(gtid_map.values())
-        if len(values) != 1:
-            print("GTID 不一致，取消后续重置。每个实例的 gtid_executed 如下：")
-            for host, gtid in gtid_map.items():
-                print(f"  {host}: {gtid}")
+        inspected, errors = run_parallel(hosts, inspect)
+        if errors:
+            report_errors("读取状态", errors)
             sys.exit(1)
+        topology = {host: topo for host, (topo, _) in inspected.items() if topo}
+        original_ro = {host: ro for host, (_, ro) in inspected.items()}
 
-        print("所有实例 GTID 一致。")
+        # 阶段2：并发设置只读（fence），之后不会再有新的业务写入
+        print("并发设置只读模式，确保没有新的写入...")
+        fence_start = time.monotonic()
 
-        # 操作前先设置只读，避免写入
-        print("操作前先设置只读模式，确保没有新的写入...")
-        original_ro = {}
-        for host, conn in conns.items():
-            original_ro[host] = get_read_only_status(conn)
+        def fence(host):
             if not original_ro[host]["read_only"]:
                 print(f"[{host}] 设置 read_only=ON")
-                set_read_only(conn, True)
+                set_read_only(conns[host], True)
             else:
                 print(f"[{host}] 已是read_only模式")
 
+        _, errors = run_parallel(hosts, fence)
+        if errors:
+            report_errors("设置只读", errors)
+            restore_read_only(conns, original_ro)
+            sys.exit(1)
+
+        # 阶段3：全部只读后再取 GTID 快照，保证检查之后不会有写入
+        print("开始检查 GTID 一致性...")
+        gtid_map, gtid_sets, errors = take_gtid_snapshot(conns, args.settle)
+        for host in hosts:
+            if host in gtid_map:
+                print(f"[{host}] GTID_EXECUTED={gtid_map[host]}")
+        if errors or gtid_sets is None:
+            report_errors("读取 GTID", errors)
+            restore_read_only(conns, original_ro)
+            sys.exit(1)
+
+        first = gtid_sets[hosts[0]]
+        if any(gtid_set != first for gtid_set in gtid_sets.values()):
+            union = GtidSet()
+            for gtid_set in gtid_sets.values():
+                union = union | gtid_set
+            print("GTID 不一致，取消后续重置。每个实例的 gtid_executed 如下：")
+            for host, gtid in gtid_map.items():
+                print(f"  {host}: {gtid}")
+                missing = union - gtid_sets[host]
+                if missing:
+                    print(f"    缺少: {missing}")
+            print("恢复所有实例原始只读设置...")
+            restore_read_only(conns, original_ro)
+            sys.exit(1)
+
+        print("所有实例 GTID 一致。")
+
         if args.dry_run:
             print("dry-run 模式，仅检查一致性通过，不执行重置。")
             # dry-run 时恢复原只读设置
-            for host, conn in conns.items():
-                ro = original_ro[host]
-                set_read_only(conn, ro["read_only"])
+            restore_read_only(conns, original_ro)
             print("已恢复原只读设置")
             return
 
-        print("开始重置所有实例并清空 GTID...")
-        for host in hosts:
-            reset_instance(conns[host], host)
+        # 阶段4：并发重置，全部完成后才进入恢复阶段
+        print("开始并发重置所有实例并清空 GTID...")
+        _, errors = run_parallel(hosts, lambda h: reset_instance(conns[h], h))
+        if errors:
+            report_errors("重置", errors)
+            print("部分实例重置失败，保持只读，请人工处理。")
+            sys.exit(1)
 
+        # 阶段5：并发恢复复制
         print("重置完成，开始恢复原有复制拓扑...")
-        for host in hosts:
-            restore_replication(conns[host], host, topology.get(host),
-                                args.replica_user, args.replica_password)
-
-        print("全部操作完成。请手动确认每个从库 SHOW SLAVE STATUS 是否 IO/SQL 都是 Yes。")
+        _, errors = run_parallel(hosts, lambda h: restore_replication(conns[h], h, topology.get(h),
+                                                                     args.replica_user, args.replica_password))
+        report_errors("恢复复制", errors)
 
         # 恢复原来只读状态
         print("恢复所有实例原始只读设置...")
-        for host, conn in conns.items():
-            ro = original_ro.get(host)
-            if ro:
-                set_read_only(conn, ro["read_only"])
-                print(f"[{host}] 恢复 read_only={ro['read_only']}, super_read_only={ro['super_read_only']}")
+        restore_read_only(conns, original_ro)
 
         # 最后确保主库可写（默认为首个 host）
         master_host = hosts[0]
         print(f"[{master_host}] 最后确保主库可写，设置 read_only=OFF")
         set_read_only(conns[master_host], False)
+        fence_end = time.monotonic()
+
+        # 阶段6：主库已可写后再并发等待各备库追平，不占用只读窗口
+        replicas = [h for h in hosts if h in topology]
+        if args.catchup_timeout <= 0 or not replicas:
+            print("全部操作完成。请手动确认每个从库 SHOW SLAVE STATUS 是否 IO/SQL 都是 Yes。")
+            return
+
+        print(f"等待 {len(replicas)} 个备库追平（最长 {args.catchup_timeout:.0f}s）...")
+        target = GtidSet.parse(get_gtid_executed(conns[master_host]))
+        deadline = time.monotonic() + args.catchup_timeout
+        results, errors = run_parallel(replicas, lambda h: wait_for_catchup(conns[h], h, target, deadline))
+        report_errors("检查复制状态", errors)
+        failed = list(errors)
+        for host in replicas:
+            if host not in results:
+                continue
+            ok, elapsed, detail = results[host]
+            if ok:
+                print(f"[{host}] 复制正常，{elapsed:.1f}s 追平")
+            else:
+                print(f"[{host}] 未能追平（{elapsed:.1f}s）: {detail}")
+                failed.append(host)
+        if failed:
+            print(f"以下备库复制未恢复正常，请人工检查: {', '.join(failed)}")
+            sys.exit(1)
+        print("全部操作完成，所有备库复制正常且已追平。")
 
     finally:
+        if fence_start is not None:
+            print(f"只读窗口: {(fence_end or time.monotonic()) - fence_start:.2f}s")
         for c in conns.values():
             c.close()
 
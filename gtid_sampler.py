@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+gtid_sampler.py
+按固定间隔采样一组实例的 gtid_executed，根据区间增量计算每个 source uuid 的 TPS，
+以及每个备库追平主库的预计时间（ETA）。无需解析 binlog，也不依赖状态计数器。
+
+每个采样点只保存各实例每个 uuid 已执行的事务数（array 存储的紧凑时间序列），
+可选以 NDJSON 追加写入文件，便于事后画图。
+
+用法示例:
+  python3 gtid_sampler.py --hosts 192.168.0.10,192.168.0.11,192.168.0.12
+  python3 gtid_sampler.py --hosts 192.168.0.10,192.168.0.11 --interval 5 --samples 60 --output tps.ndjson
+"""
+
+import argparse
+import json
+import sys
+import time
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+from compare_gtid import DEFAULT_PASSWORD, DEFAULT_PORT, DEFAULT_USER, GtidSet, fetch_gtids
+
+# 内存中保留的采样点数
+DEFAULT_MAX_SAMPLES = 3600
+
+
+class GtidSeries:
+    """紧凑时间序列：时间戳存于 array('d')，每个 (host, uuid) 的事务数存于 array('q')。
+
+    某次采样中实例不可达或尚无该 uuid 时记为 -1，计算速率时跳过。
+    超过 maxlen 后丢弃最早的采样点。
+    """
+
+    def __init__(self, maxlen: int = DEFAULT_MAX_SAMPLES):
+        self.maxlen = maxlen
+        self.timestamps = array('d')
+        self.counts: Dict[Tuple[str, str], array] = {}
+
+    def append(self, ts: float, counts: Dict[str, Dict[str, int]]):
+        """counts 为 {host: {uuid: 已执行事务数}}"""
+        n = len(self.timestamps)
+        self.timestamps.append(ts)
+        for host, per_uuid in counts.items():
+            for uuid in per_uuid:
+                if (host, uuid) not in self.counts:
+                    self.counts[(host, uuid)] = array('q', [-1] * n)
+        for (host, uuid), series in self.counts.items():
+            series.append(counts.get(host, {}).get(uuid, -1))
+
+        if len(self.timestamps) > self.maxlen:
+            drop = len(self.timestamps) - self.maxlen
+            del self.timestamps[:drop]
+            for series in self.counts.values():
+                del series[:drop]
+
+    def rate(self, host: str, uuid: str, window: int) -> Optional[float]:
+        """最近 window 个采样间隔内的平均每秒事务数，数据不足时返回 None"""
+        series = self.counts.get((host, uuid))
+        if not series or len(series) < 2:
+            return None
+        last = len(series) - 1
+        if series[last] < 0:
+            return None
+        for i in range(max(0, last - window), last):
+            if series[i] >= 0:
+                elapsed = self.timestamps[last] - self.timestamps[i]
+                return (series[last] - series[i]) / elapsed if elapsed > 0 else None
+        return None
+
+    def host_rate(self, host: str, window: int) -> Optional[float]:
+        rates = [self.rate(h, uuid, window) for h, uuid in self.counts if h == host]
+        rates = [r for r in rates if r is not None]
+        return sum(rates) if rates else None
+
+    def uuids(self, host: str) -> List[str]:
+        return sorted(uuid for h, uuid in self.counts if h == host)
+
+
+def catchup_eta(behind: int, replica_rate: Optional[float], primary_rate: Optional[float]) -> Optional[float]:
+    """落后 behind 个事务时的追平秒数；追赶速度不超过主库写入速度时返回 None（追不上）"""
+    if behind <= 0:
+        return 0.0
+    if replica_rate is None or primary_rate is None:
+        return None
+    gain = replica_rate - primary_rate
+    return behind / gain if gain > 0 else None
+
+
+def sample(hosts: List[str], primary: str, user: str, password: str, port: int) -> Dict:
+    """采样一次，返回 {'ts', 'counts': {host: {uuid: n}}, 'behind': {replica: n}, 'errors'}"""
+    ts = time.time()
+    gtids, errors = fetch_gtids(hosts, user, password, port)
+    sets = {host: GtidSet.parse(gtid) for host, gtid in gtids.items()}
+    counts = {host: {uuid: gtid_set.count(uuid) for uuid in gtid_set.uuids()} for host, gtid_set in sets.items()}
+    behind = {}
+    if primary in sets:
+        for host, gtid_set in sets.items():
+            if host != primary:
+                behind[host] = (sets[primary] - gtid_set).count()
+    return {"ts": ts, "counts": counts, "behind": behind, "errors": errors}
+
+
+def format_eta(seconds: Optional[float]) -> str:
+    if seconds is None:
+        return "追不上"
+    if seconds < 1:
+        return "已追平"
+    return time.strftime('%H:%M:%S', time.gmtime(seconds)) if seconds < 86400 else f"{seconds / 86400:.1f}天"
+
+
+def print_report(series: GtidSeries, record: Dict, hosts: List[str], primary: str, window: int):
+    print(f"\n[{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(record['ts']))}]")
+    for host, err in record['errors'].items():
+        print(f"  {host} 采样失败: {err}")
+
+    primary_rate = series.host_rate(primary, window)
+    if primary_rate is None:
+        print("  等待下一次采样以计算速率...")
+        return
+    print(f"  主库 {primary} 总 TPS: {primary_rate:.1f}")
+    for uuid in series.uuids(primary):
+        rate = series.rate(primary, uuid, window)
+        if rate:
+            print(f"    {uuid}: {rate:.1f}/s")
+
+    for host in hosts:
+        if host == primary or host not in record['behind']:
+            continue
+        replica_rate = series.host_rate(host, window)
+        behind = record['behind'][host]
+        eta = catchup_eta(behind, replica_rate, primary_rate)
+        rate_str = f"{replica_rate:.1f}/s" if replica_rate is not None else "-"
+        print(f"  备库 {host}: 落后 {behind} 个事务，应用速度 {rate_str}，预计追平 {format_eta(eta)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="基于 GTID 的 TPS 与备库追平时间采样")
+    parser.add_argument("--hosts", required=True, help="逗号分隔的实例 IP")
+    parser.add_argument("--primary", help="主库 IP，默认 --hosts 中第一个")
+    parser.add_argument("--interval", type=float, default=1.0, help="采样间隔（秒），默认 1")
+    parser.add_argument("--samples", type=int, default=0, help="采样次数，默认 0 表示一直运行")
+    parser.add_argument("--window", type=int, default=10, help="计算速率的滑动窗口（采样间隔数），默认 10")
+    parser.add_argument("--output", help="以 NDJSON 追加写入每个采样点")
+    parser.add_argument("--user", default=DEFAULT_USER, help="MySQL 用户，默认为空")
+    parser.add_argument("--password", default=DEFAULT_PASSWORD, help="MySQL 密码,默认为空")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="MySQL 端口，默认 3306")
+    args = parser.parse_args()
+
+    hosts = list(dict.fromkeys(h.strip() for h in args.hosts.split(',') if h.strip()))
+    primary = args.primary or hosts[0]
+    if primary not in hosts:
+        hosts.insert(0, primary)
+
+    series = GtidSeries()
+    out = open(args.output, 'a', encoding='utf-8') if args.output else None
+    taken = 0
+    next_at = time.monotonic()
+    try:
+        while not args.samples or taken < args.samples:
+            record = sample(hosts, primary, args.user, args.password, args.port)
+            series.append(record['ts'], record['counts'])
+            taken += 1
+            print_report(series, record, hosts, primary, max(1, args.window))
+            if out:
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                out.flush()
+            # 按固定节拍采样，扣除本次采样耗时
+            next_at += args.interval
+            time.sleep(max(0.0, next_at - time.monotonic()))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if out:
+            out.close()
+    sys.exit(0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+ha_bench.py
+比较 ha_meta.py 各后端加载整个 HA 前缀的耗时：读取前缀、JSON 解析并建立 vip 索引。
+
+用法示例:
+  # 对比 etcd 客户端、JSON 网关和本地快照
+  python3 ha_bench.py --prefix /db/ha/arbit/192.168.250 \\
+      --backend etcd://127.0.0.1:2379 --backend http://127.0.0.1:2379 --backend file:///tmp/ha_snapshot.json
+  # 无 etcd 环境时生成 N 条合成记录的快照再测试
+  python3 ha_bench.py --generate 50000 --backend file:///tmp/ha_bench.json
+"""
+
+import argparse
+import json
+import sys
+import time
+from typing import List, Tuple
+
+from ha_meta import HaEntry, HaIndex, HaMetaError, open_backend, save_snapshot
+
+DEFAULT_PREFIX = "/db/ha/arbit/192.168.250"
+
+
+def generate_snapshot(path: str, prefix: str, count: int):
+    """生成与线上 HA 记录结构相同的合成快照"""
+    entries = []
+    for i in range(count):
+        record = {
+            "vip": f"10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}",
+            "master": f"192.168.{i // 256 % 256}.{i % 256}",
+            "slave": f"192.169.{i // 256 % 256}.{i % 256}",
+            "db_instance": f"cluster{i:06d}_00",
+        }
+        entries.append(HaEntry(f"{prefix}/cluster{i:06d}", json.dumps(record).encode("utf-8"), i + 1))
+    save_snapshot(path, prefix, entries, count)
+
+
+def bench_backend(spec: str, prefix: str, repeat: int) -> Tuple[int, float, float]:
+    """返回 (条目数, 读取前缀最佳耗时, 读取+解析+建索引最佳耗时)"""
+    best_fetch = best_load = float("inf")
+    count = 0
+    for _ in range(repeat):
+        # 每轮重新打开后端，避免快照后端的文件缓存影响结果
+        backend = open_backend(spec)
+        start = time.perf_counter()
+        entries, _ = backend.get_prefix(prefix)
+        best_fetch = min(best_fetch, time.perf_counter() - start)
+        count = len(entries)
+
+        backend = open_backend(spec)
+        start = time.perf_counter()
+        HaIndex(backend, prefix).load()
+        best_load = min(best_load, time.perf_counter() - start)
+    return count, best_fetch, best_load
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HA 元数据前缀加载基准测试")
+    parser.add_argument("--backend", action="append", default=[],
+                        help="后端（etcd://、http://、file://），可重复指定")
+    parser.add_argument("--prefix", default=DEFAULT_PREFIX, help=f"测试的前缀，默认 {DEFAULT_PREFIX}")
+    parser.add_argument("--repeat", type=int, default=3, help="每个后端重复次数，取最好成绩，默认 3")
+    parser.add_argument("--generate", type=int, default=0,
+                        help="先向 file:// 后端写入 N 条合成记录（只对第一个 file 后端生效）")
+    args = parser.parse_args()
+
+    if not args.backend:
+        parser.error("至少指定一个 --backend")
+
+    if args.generate:
+        files = [b for b in args.backend if not b.startswith(("etcd://", "http://", "https://"))]
+        if not files:
+            parser.error("--generate 需要一个 file:// 后端")
+        path = files[0][len("file://"):] if files[0].startswith("file://") else files[0]
+        generate_snapshot(path, args.prefix, args.generate)
+        print(f"已生成 {args.generate} 条合成记录: {path}")
+
+    failed: List[str] = []
+    print(f"\n{'后端':<40}{'条目数':>8}{'读取(s)':>10}{'加载(s)':>10}{'us/条':>10}")
+    for spec in args.backend:
+        try:
+            count, fetch, load = bench_backend(spec, args.prefix, max(1, args.repeat))
+        except HaMetaError as err:
+            print(f"{spec:<40}  失败: {err}")
+            failed.append(spec)
+            continue
+        per_entry = load / max(count, 1) * 1e6
+        print(f"{spec:<40}{count:>8}{fetch:>10.3f}{load:>10.3f}{per_entry:>10.1f}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
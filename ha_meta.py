@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+"""
+ha_meta.py
+HA 元数据（/db/ha/...）访问层，update_backup.py、downgrade.py 等脚本通过它读取 etcd 中的 HA 信息，
+后端可互换：
+  etcd://host:port          etcd3 gRPC 客户端（需要 etcd3 / grpc / protobuf）
+  http://host:port          etcd v3 JSON 网关（/v3/kv/range），只依赖标准库
+  file:///path/to/ha.json   本地快照文件，批量工具可离线快速读取
+
+用法示例:
+  # 把 /db/ha 前缀导出为本地快照
+  python3 ha_meta.py snapshot --backend etcd://127.0.0.1:2379 --prefix /db/ha --output /tmp/ha_snapshot.json
+"""
+
+import abc
+import argparse
+import base64
+import json
+import os
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from cmdb import save_json_atomic
+
+# 默认后端，可通过环境变量切换到网关或本地快照
+DEFAULT_BACKEND = os.getenv('HA_META_BACKEND', 'etcd://127.0.0.1:2379')
+# JSON 网关请求超时（秒）
+GATEWAY_TIMEOUT = 10
+
+
+class HaMetaError(Exception):
+    """后端读取失败，统一包装 etcd3 / HTTP / 文件错误"""
+
+
+class HaEntry(NamedTuple):
+    key: str
+    value: bytes
+    mod_revision: int
+
+
+def prefix_version(entries: List[HaEntry]) -> Tuple[int, int]:
+    """前缀的版本标识 (key 数量, 最大 mod_revision)，任何增删改都会使其变化"""
+    return len(entries), max((e.mod_revision for e in entries), default=0)
+
+
+class HaBackend(abc.ABC):
+    """后端接口。get_prefix 返回 (按 key 排序的条目, 读取时的 revision)"""
+
+    @abc.abstractmethod
+    def get_prefix(self, prefix: str) -> Tuple[List[HaEntry], int]:
+        ...
+
+    def prefix_version(self, prefix: str) -> Tuple[int, int]:
+        """(key 数量, 最大 mod_revision)，远程后端应只用一次不传输整个前缀的查询实现"""
+        return prefix_version(self.get_prefix(prefix)[0])
+
+    def watch_prefix(self, prefix: str, callback: Callable, start_revision: Optional[int] = None):
+        """监听前缀变化，callback 收到 [(key, value 或删除时为 None), ...] 或异常。
+        不支持 watch 的后端返回 None，由调用方改用 prefix_version 检查。
+        """
+        return None
+
+    def cancel_watch(self, watch_id):
+        pass
+
+
+class EtcdClientBackend(HaBackend):
+    def __init__(self, host: str, port: int):
+        # 只有该后端依赖 etcd3，网关和快照后端无需安装。
+        # etcd3 生成的 pb2 代码与 protobuf>=4 的 C++ 实现不兼容，需在导入前改用纯 Python 实现
+        os.environ.setdefault("PROTOCOL_BUFFERS_PYTHON_IMPLEMENTATION", "python")
+        import etcd3
+        self._etcd3 = etcd3
+        self.client = etcd3.client(host=host, port=port)
+
+    def get_prefix(self, prefix):
+        entries, revision = [], 0
+        try:
+            for value, metadata in self.client.get_prefix(prefix):
+                entries.append(HaEntry(metadata.key.decode("utf-8"), value or b"", metadata.mod_revision))
+                revision = max(revision, metadata.response_header.revision)
+        except self._etcd3.exceptions.Etcd3Exception as err:
+            raise HaMetaError(f"etcd 读取 {prefix} 失败: {err}") from err
+        return entries, revision
+
+    def prefix_version(self, prefix):
+        # 按 mod_revision 倒序只取一个 key，响应中的 count 仍是整个前缀的 key 数
+        try:
+            response = self.client.get_prefix_response(prefix, keys_only=True, limit=1,
+                                                        sort_order="descend", sort_target="mod")
+        except self._etcd3.exceptions.Etcd3Exception as err:
+            raise HaMetaError(f"etcd 读取 {prefix} 失败: {err}") from err
+        return response.count, response.kvs[0].mod_revision if response.kvs else 0
+
+    def watch_prefix(self, prefix, callback, start_revision=None):
+        delete_event = self._etcd3.events.DeleteEvent
+
+        def on_response(response):
+            if isinstance(response, Exception):
+                callback(response)
+                return
+            callback([(event.key.decode("utf-8"), None if isinstance(event, delete_event) else event.value)
+                      for event in response.events])
+
+        return self.client.add_watch_prefix_callback(prefix, on_response, start_revision=start_revision)
+
+    def cancel_watch(self, watch_id):
+        self.client.cancel_watch(watch_id)
+
+
+def _range_end(prefix: bytes) -> bytes:
+    """etcd 前缀查询的 range_end：最后一个非 0xff 字节加一"""
+    end = bytearray(prefix)
+    while end and end[-1] == 0xff:
+        end.pop()
+    if not end:
+        return b"\0"
+    end[-1] += 1
+    return bytes(end)
+
+
+class EtcdGatewayBackend(HaBackend):
+    """etcd v3 JSON 网关（grpc-gateway），key/value 以 base64 传输"""
+
+    def __init__(self, url: str, timeout: float = GATEWAY_TIMEOUT):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+
+    def _range(self, prefix: str, **options) -> Dict[str, Any]:
+        key = prefix.encode("utf-8")
+        body = {
+            "key": base64.b64encode(key).decode(),
+            "range_end": base64.b64encode(_range_end(key)).decode(),
+            "sort_order": "ASCEND",
+        }
+        body.update(options)
+        request = urllib.request.Request(f"{self.url}/v3/kv/range", data=json.dumps(body).encode(),
+                                         headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as resp:
+                return json.load(resp)
+        except (urllib.error.URLError, OSError, ValueError) as err:
+            raise HaMetaError(f"etcd 网关读取 {prefix} 失败: {err}") from err
+
+    def get_prefix(self, prefix):
+        data = self._range(prefix)
+        entries = [HaEntry(base64.b64decode(kv["key"]).decode("utf-8"),
+                           base64.b64decode(kv.get("value", "")),
+                           int(kv.get("mod_revision", 0)))
+                   for kv in data.get("kvs", [])]
+        return entries, int(data.get("header", {}).get("revision", 0))
+
+    def prefix_version(self, prefix):
+        # 与 etcd 客户端后端相同：倒序取最新修改的一个 key，count 为整个前缀的 key 数
+        data = self._range(prefix, keys_only=True, limit=1, sort_order="DESCEND", sort_target="MOD")
+        kvs = data.get("kvs", [])
+        return int(data.get("count", 0)), int(kvs[0].get("mod_revision", 0)) if kvs else 0
+
+
+class SnapshotBackend(HaBackend):
+    """本地快照文件，文件修改后自动重新读取"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._mtime = None
+        self._entries: List[HaEntry] = []
+        self._revision = 0
+
+    def _load(self):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+            if mtime == self._mtime:
+                return
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as err:
+            raise HaMetaError(f"快照 {self.path} 读取失败: {err}") from err
+        self._entries = sorted((HaEntry(kv["key"], kv["value"].encode("utf-8"), kv.get("mod_revision", 0))
+                                for kv in data.get("kvs", [])), key=lambda e: e.key)
+        self._revision = data.get("revision", 0)
+        self._mtime = mtime
+
+    def get_prefix(self, prefix):
+        self._load()
+        return [e for e in self._entries if e.key.startswith(prefix)], self._revision
+
+
+def open_backend(spec: str = DEFAULT_BACKEND) -> HaBackend:
+    """按 etcd://、http(s)://、file:// 前缀选择后端，不带前缀的视为快照文件路径"""
+    if spec.startswith("etcd://"):
+        host, _, port = spec[len("etcd://"):].partition(":")
+        return EtcdClientBackend(host, int(port or 2379))
+    if spec.startswith(("http://", "https://")):
+        return EtcdGatewayBackend(spec)
+    if spec.startswith("file://"):
+        return SnapshotBackend(spec[len("file://"):])
+    return SnapshotBackend(spec)
+
+
+def save_snapshot(path: str, prefix: str, entries: List[HaEntry], revision: int = 0) -> int:
+    """把前缀下的条目原子写入快照文件（SnapshotBackend 的格式），返回条目数"""
+    save_json_atomic(path, {
+        "version": 1,
+        "saved_at": time.time(),
+        "prefix": prefix,
+        "revision": revision,
+        "kvs": [{"key": e.key, "value": e.value.decode("utf-8"), "mod_revision": e.mod_revision}
+                for e in entries],
+    })
+    return len(entries)
+
+
+class HaIndex:
+    """仲裁前缀下 vip -> HA 记录的本地索引
+
+    一次 get_prefix 读取整个前缀并解析 JSON，之后按 vip 查找为 O(1)。
+    watch=True 且后端支持时通过 watch 增量更新索引，查找不再访问后端，用完需调用 close()；
+    否则每次复用前比较 prefix_version（etcd 后端只取 count 和最新的一个 key），
+    有增删改时才重新加载。
+    """
+
+    def __init__(self, backend: HaBackend, prefix: str, watch: bool = False):
+        self.backend = backend
+        self.prefix = prefix
+        self.watch = watch
+        self._by_key: Dict[str, Dict[str, Any]] = {}
+        self._by_vip: Dict[str, Dict[str, Any]] = {}
+        self._version = None
+        self._watch_id = None
+        self._stale = True
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _decode(key: str, value: bytes):
+        try:
+            return json.loads(value.decode("utf-8"))
+        except json.JSONDecodeError as err:
+            print(f"JSON Parse Error for key {key}: {err}")
+            return None
+
+    def _reindex(self):
+        # 与逐个扫描时一致：同一 vip 有多条记录时取 key 排序最前的一条
+        by_vip = {}
+        for key in sorted(self._by_key):
+            record = self._by_key[key]
+            if isinstance(record, dict):
+                by_vip.setdefault(record.get("vip"), record)
+        self._by_vip = by_vip
+
+    def load(self):
+        """全量读取前缀并重建索引，启用 watch 时从读取到的 revision 之后开始监听"""
+        entries, revision = self.backend.get_prefix(self.prefix)
+        by_key = {}
+        for entry in entries:
+            if entry.value:
+                record = self._decode(entry.key, entry.value)
+                if record is not None:
+                    by_key[entry.key] = record
+        with self._lock:
+            self._by_key = by_key
+            self._reindex()
+            self._version = prefix_version(entries)
+            self._stale = False
+        if self.watch and self._watch_id is None:
+            self._watch_id = self.backend.watch_prefix(
+                self.prefix, self._on_watch, start_revision=revision + 1 if revision else None)
+
+    def _on_watch(self, changes):
+        if isinstance(changes, Exception):
+            # watch 断开后下次查询重新全量加载并重新 watch
+            with self._lock:
+                self._stale = True
+                self._watch_id = None
+            return
+        with self._lock:
+            for key, value in changes:
+                if value is None:
+                    self._by_key.pop(key, None)
+                elif value:
+                    record = self._decode(key, value)
+                    if record is not None:
+                        self._by_key[key] = record
+            self._reindex()
+
+    def _refresh(self):
+        if self._stale:
+            self.load()
+        elif self._watch_id is None and self.backend.prefix_version(self.prefix) != self._version:
+            self.load()
+
+    def get(self, vip: str):
+        """按 vip 查找 HA 记录，找不到返回 None"""
+        self._refresh()
+        with self._lock:
+            return self._by_vip.get(vip)
+
+    def records(self) -> List[Dict[str, Any]]:
+        self._refresh()
+        with self._lock:
+            return [self._by_key[key] for key in sorted(self._by_key)]
+
+    def close(self):
+        if self._watch_id is not None:
+            self.backend.cancel_watch(self._watch_id)
+            self._watch_id = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HA 元数据访问层工具")
+    sub = parser.add_subparsers(dest="command")
+    snap = sub.add_parser("snapshot", help="把前缀导出为本地快照文件")
+    snap.add_argument("--backend", default=DEFAULT_BACKEND, help=f"数据来源，默认 {DEFAULT_BACKEND}")
+    snap.add_argument("--prefix", default="/db/ha", help="导出的前缀，默认 /db/ha")
+    snap.add_argument("--output", required=True, help="快照文件路径")
+    args = parser.parse_args()
+
+    if args.command != "snapshot":
+        parser.print_help()
+        sys.exit(1)
+    try:
+        entries, revision = open_backend(args.backend).get_prefix(args.prefix)
+        count = save_snapshot(args.output, args.prefix, entries, revision)
+    except HaMetaError as err:
+        print(err)
+        sys.exit(1)
+    print(f"已导出 {count} 条记录到 {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,14 +3,24 @@ import argparse
 import pymysql
 import logging
 import logging.handlers
+import os
 import re
-from typing import List, Dict, Any, Optional, Set
+import shlex
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Set, Tuple
+
+import cmdb
+from remote_run import run_remote
 
 # 配置日志
 LOG_FILE = "/tmp/mysql_binlog_cleaner.log"
 logging.basicConfig(
     level=logging.INFO,
-    format='%(asctime)s [%(levelname)s] %(message)s',
+    format='%(asctime)s [%(levelname)s] [%(threadName)s] %(message)s',
     datefmt='%Y-%m-%d %H:%M:%S',
     handlers=[
         logging.handlers.RotatingFileHandler(
@@ -35,12 +45,31 @@ MYSQL_CONFIG = {
 
 # 最大递归深度
 MAX_RECURSION_DEPTH = 4
+# 拓扑发现时每层并发探测的最大线程数
+MAX_DISCOVERY_WORKERS = 16
+
+# 分批清理：主库挂起I/O数、备库延迟（秒）阈值，超过则暂停
+DEFAULT_MAX_PENDING_IO = 64
+DEFAULT_MAX_REPLICA_LAG = 30
+PURGE_PAUSE_INTERVAL = 5
+MAX_PURGE_PAUSE = 1800
+
+# 批量模式：并发处理的集群数、单集群处理时限（秒）
+DEFAULT_CLUSTER_PARALLEL = 8
+DEFAULT_CLUSTER_TIMEOUT = 1800
 
-def connect_mysql(host: str) -> Optional[pymysql.Connection]:
+# 实例连接超时与读写超时（秒）：节点无响应时各阶段也能按时返回，单集群时限在阶段之间检查
+MYSQL_CONNECT_TIMEOUT = 5
+MYSQL_IO_TIMEOUT = 60
+# PURGE BINARY LOGS 一次删除大量文件可能较慢，主库连接使用更长的读超时
+PURGE_READ_TIMEOUT = 600
+
+def connect_mysql(host: str, read_timeout: int = MYSQL_IO_TIMEOUT) -> Optional[pymysql.Connection]:
     """连接到MySQL服务器"""
     try:
         config = MYSQL_CONFIG.copy()
-        config["host"] = host
+        config.update(host=host, connect_timeout=MYSQL_CONNECT_TIMEOUT,
+                      read_timeout=read_timeout, write_timeout=MYSQL_IO_TIMEOUT)
         conn = pymysql.connect(**config)
         logging.info(f"成功连接到MySQL服务器: {host}")
         return conn
@@ -48,125 +77,207 @@ def connect_mysql(host: str) -> Optional[pymysql.Connection]:
         logging.error(f"连接MySQL服务器失败 {host}: {e}")
         return None
 
-def is_slave(conn: pymysql.Connection) -> bool:
-    """检查当前服务器是否是备库"""
-    try:
-        with conn.cursor() as cursor:
-            cursor.execute("SHOW SLAVE STATUS")
-            result = cursor.fetchone()
-            return result is not None
-    except pymysql.Error as e:
-        logging.error(f"检查备库状态失败: {e}")
-        return False
-
-def get_master_info(conn: pymysql.Connection) -> Optional[Dict[str, Any]]:
-    """获取主库信息"""
-    try:
-        with conn.cursor() as cursor:
-            cursor.execute("SHOW SLAVE STATUS")
-            result = cursor.fetchone()
-            if result:
-                return {
-                    "master_host": result.get("Master_Host"),
-                    "master_port": result.get("Master_Port"),
-                    "relay_master_log_file": result.get("Relay_Master_Log_File")
-                }
-            return None
-    except pymysql.Error as e:
-        logging.error(f"获取主库信息失败: {e}")
-        return None
-
-def find_master_recursive(ip: str, depth: int = 0) -> Optional[str]:
-    """递归向上查找主库，最大深度4层"""
-    if depth >= MAX_RECURSION_DEPTH:
-        logging.warning(f"达到最大递归深度 {MAX_RECURSION_DEPTH}，停止查找")
-        return None
-    
+def probe_node(ip: str) -> Dict[str, Any]:
+    """连接节点一次，采集 read_only、SHOW SLAVE STATUS 和 Binlog Dump 线程"""
+    node = {
+        "ip": ip,
+        "reachable": False,
+        "read_only": None,
+        "slave_status": None,
+        "dump_hosts": [],
+        "role": "unreachable",
+    }
     conn = connect_mysql(ip)
     if not conn:
-        return None
-    
-    try:
-        if not is_slave(conn):
-            logging.info(f"找到主库: {ip}")
-            return ip
-        
-        master_info = get_master_info(conn)
-        if not master_info or not master_info["master_host"]:
-            logging.warning(f"无法获取主库信息 from {ip}")
-            return None
-        
-        master_ip = master_info["master_host"]
-        logging.info(f"从 {ip} 找到上层主库: {master_ip}")
-        return find_master_recursive(master_ip, depth + 1)
-    finally:
-        conn.close()
+        return node
 
-def is_master_writable(conn: pymysql.Connection) -> bool:
-    """检查主库是否可写"""
     try:
         with conn.cursor() as cursor:
             cursor.execute("SELECT @@read_only AS read_only")
-            result = cursor.fetchone()
-            return result and result["read_only"] == 0
-    except pymysql.Error as e:
-        logging.error(f"检查主库可写状态失败: {e}")
-        return False
+            node["read_only"] = cursor.fetchone()["read_only"] == 1
 
-def find_slaves_recursive(ip: str, depth: int = 0, visited: Optional[Set[str]] = None) -> Set[str]:
-    """递归向下查找所有备库"""
-    if visited is None:
-        visited = set()
-    
-    if depth >= MAX_RECURSION_DEPTH:
-        logging.warning(f"达到最大递归深度 {MAX_RECURSION_DEPTH}，停止查找")
-        return visited
-    
-    if ip in visited:
-        return visited
-    
-    visited.add(ip)
-    conn = connect_mysql(ip)
-    if not conn:
-        return visited
-    
-    try:
-        # 通过processlist查找连接的备库
-        with conn.cursor() as cursor:
+            cursor.execute("SHOW SLAVE STATUS")
+            node["slave_status"] = cursor.fetchone()
+
+            # 通过processlist查找连接的备库
             cursor.execute("""
                 SELECT USER, HOST FROM information_schema.processlist 
                 WHERE COMMAND = 'Binlog Dump' OR COMMAND = 'Binlog Dump GTID'
             """)
-            processes = cursor.fetchall()
-            
-            for process in processes:
+            for process in cursor.fetchall():
                 # 从HOST字段提取IP地址
                 host = process["HOST"]
                 if host and ":" in host:
-                    slave_ip = host.split(":")[0]
-                    if slave_ip not in visited:
-                        logging.info(f"从 {ip} 找到备库: {slave_ip}")
-                        visited.update(find_slaves_recursive(slave_ip, depth + 1, visited))
-        
-        return visited
+                    node["dump_hosts"].append(host.split(":")[0])
+        node["reachable"] = True
     except pymysql.Error as e:
-        logging.error(f"查找备库失败: {e}")
-        return visited
+        logging.error(f"采集节点信息失败 {ip}: {e}")
     finally:
         conn.close()
 
-def get_relay_master_log_file(conn: pymysql.Connection) -> Optional[str]:
-    """获取Relay_Master_Log_File"""
+    if node["reachable"]:
+        if not node["slave_status"]:
+            node["role"] = "master"
+        elif node["dump_hosts"]:
+            node["role"] = "relay"
+        else:
+            node["role"] = "slave"
+    return node
+
+
+class ReplicationDiscovery:
+    """并发广度优先发现复制拓扑，每个节点只连接一次。
+
+    每一层的节点并发探测，沿 Master_Host（向上）和 Binlog Dump 线程（向下）扩展下一层，
+    探测结果缓存在 self.nodes 中，本次运行内后续步骤直接读取缓存，不再重复连接。
+    """
+
+    def __init__(self, max_workers: int = MAX_DISCOVERY_WORKERS):
+        self.max_workers = max_workers
+        self.nodes: Dict[str, Dict[str, Any]] = {}
+
+    def discover(self, ip: str, max_depth: int = MAX_RECURSION_DEPTH * 2) -> Dict[str, Dict[str, Any]]:
+        """从 ip 出发逐层发现，max_depth 为最大层数（默认向上、向下各 MAX_RECURSION_DEPTH 层）"""
+        frontier = [ip]
+        depth = 0
+        while frontier:
+            if depth >= max_depth:
+                logging.warning(f"达到最大发现层数 {max_depth}，停止查找: {frontier}")
+                break
+            self.probe(frontier)
+
+            next_frontier = []
+            for node_ip in frontier:
+                for neighbor in self._neighbors(self.nodes[node_ip]):
+                    if neighbor not in self.nodes and neighbor not in next_frontier:
+                        next_frontier.append(neighbor)
+            frontier = next_frontier
+            depth += 1
+        return self.nodes
+
+    def probe(self, ips: List[str]):
+        """并发探测一批尚未缓存的节点并写入缓存"""
+        ips = [ip for ip in ips if ip not in self.nodes]
+        if not ips:
+            return
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(ips))) as pool:
+            for node in pool.map(probe_node, ips):
+                self.nodes[node["ip"]] = node
+
+    @staticmethod
+    def _neighbors(node: Dict[str, Any]) -> List[str]:
+        neighbors = list(node["dump_hosts"])
+        status = node["slave_status"]
+        if status and status.get("Master_Host"):
+            neighbors.append(status["Master_Host"])
+        return neighbors
+
+    def find_master(self, ip: str) -> Optional[str]:
+        """沿缓存中的 Master_Host 向上查找主库"""
+        seen = set()
+        while ip not in seen:
+            seen.add(ip)
+            node = self.nodes.get(ip)
+            if not node or not node["reachable"]:
+                logging.warning(f"无法获取节点信息: {ip}")
+                return None
+            status = node["slave_status"]
+            if not status:
+                logging.info(f"找到主库: {ip}")
+                return ip
+            if not status.get("Master_Host"):
+                logging.warning(f"无法获取主库信息 from {ip}")
+                return None
+            logging.info(f"从 {ip} 找到上层主库: {status['Master_Host']}")
+            ip = status["Master_Host"]
+        logging.error(f"复制链路存在环，无法确定主库: {ip}")
+        return None
+
+    def find_slaves(self, master_ip: str) -> Set[str]:
+        """沿缓存中的 Binlog Dump 线程向下查找所有备库（不含主库自身）"""
+        slaves: Set[str] = set()
+        frontier = [master_ip]
+        while frontier:
+            next_frontier = []
+            for ip in frontier:
+                node = self.nodes.get(ip)
+                if not node:
+                    continue
+                for slave_ip in node["dump_hosts"]:
+                    if slave_ip != master_ip and slave_ip not in slaves:
+                        logging.info(f"从 {ip} 找到备库: {slave_ip}")
+                        slaves.add(slave_ip)
+                        next_frontier.append(slave_ip)
+            frontier = next_frontier
+        return slaves
+
+def get_cmdb_cluster_ips(ip: str) -> Optional[Set[str]]:
+    """从CMDB获取ip所在集群登记的所有实例ip，查询失败返回None"""
+    try:
+        conn = pymysql.connect(**MYSQL_CONFIG)
+    except pymysql.Error as e:
+        logging.error(f"连接CMDB失败: {e}")
+        return None
     try:
         with conn.cursor() as cursor:
-            cursor.execute("SHOW SLAVE STATUS")
-            result = cursor.fetchone()
-            if result and result.get("Relay_Master_Log_File"):
-                return result["Relay_Master_Log_File"]
-            return None
+            cursor.execute("""
+                SELECT ip FROM mysql_cluster_instance
+                WHERE cluster_name = (SELECT cluster_name FROM mysql_cluster_instance WHERE ip = %s)
+            """, (ip,))
+            return {row["ip"] for row in cursor.fetchall()}
     except pymysql.Error as e:
-        logging.error(f"获取Relay_Master_Log_File失败: {e}")
+        logging.error(f"查询CMDB集群实例失败 {ip}: {e}")
+        return None
+    finally:
+        conn.close()
+
+def binlog_number(binlog_file: str) -> Optional[int]:
+    """取二进制日志文件的序号，如 mysql-bin.000012 -> 12"""
+    match = re.search(r'\.(\d+)$', binlog_file)
+    return int(match.group(1)) if match else None
+
+def compute_safe_purge_target(discovery: ReplicationDiscovery, master_ip: str,
+                              cmdb_ips: Set[str]) -> Optional[str]:
+    """计算所有直连备库都已不再需要的最后一个binlog文件
+
+    候选备库包括拓扑发现到的备库，以及CMDB中登记但当前未连接主库的实例（会补充探测）。
+    只有复制源是该主库的备库读取主库的binlog，取它们 Relay_Master_Log_File 的最小值再减1。
+    任一候选备库无法确定位点时返回None，宁可不清理也不误删备库仍需要的日志。
+    """
+    discovered = discovery.find_slaves(master_ip)
+    candidates = (discovered | cmdb_ips) - {master_ip}
+    discovery.probe(sorted(candidates))
+
+    master_dump_hosts = set(discovery.nodes[master_ip]["dump_hosts"])
+    safe_file = None
+    for ip in sorted(candidates):
+        node = discovery.nodes[ip]
+        if not node["reachable"]:
+            logging.error(f"备库 {ip} 无法连接，无法确认其复制位点，本次不清理")
+            return None
+        status = node["slave_status"]
+        if not status:
+            logging.warning(f"实例 {ip} 未配置复制，跳过")
+            continue
+        if status.get("Master_Host") != master_ip and ip not in master_dump_hosts:
+            # 级联备库读取的是中间库的binlog，与主库清理无关
+            continue
+
+        relay_file = status.get("Relay_Master_Log_File")
+        if not relay_file or binlog_number(relay_file) is None:
+            logging.error(f"备库 {ip} 没有有效的Relay_Master_Log_File，本次不清理")
+            return None
+        if ip not in discovered:
+            logging.warning(f"备库 {ip} 未连接主库（CMDB登记），按其位点 {relay_file} 保留日志")
+        logging.info(f"备库 {ip} Relay_Master_Log_File: {relay_file}")
+        if safe_file is None or binlog_number(relay_file) < binlog_number(safe_file):
+            safe_file = relay_file
+
+    if safe_file is None:
+        logging.warning(f"主库 {master_ip} 没有直连备库，不执行清理")
         return None
+    logging.info(f"所有备库中最小的Relay_Master_Log_File: {safe_file}")
+    return decrement_binlog_file(safe_file)
 
 def decrement_binlog_file(binlog_file: str) -> Optional[str]:
     """对二进制日志文件减1"""
@@ -188,70 +299,440 @@ def decrement_binlog_file(binlog_file: str) -> Optional[str]:
     logging.info(f"二进制日志文件减1: {binlog_file} -> {new_binlog_file}")
     return new_binlog_file
 
-def purge_binary_logs(master_conn: pymysql.Connection, binlog_file: str):
-    """在主库执行purge binary logs命令"""
+def parse_size(size: str) -> int:
+    """解析带单位的大小，如 100M、2G、512K，不带单位按字节"""
+    match = re.match(r'^\s*(\d+(?:\.\d+)?)\s*([KMGT]?)B?\s*$', str(size), re.IGNORECASE)
+    if not match:
+        raise ValueError(f"无效的大小: {size}")
+    unit = match.group(2).upper()
+    return int(float(match.group(1)) * (1024 ** " KMGT".index(unit or " ")))
+
+def min_free_arg(value: str) -> str:
+    """argparse 的 --min-free 类型检查：N[KMGT] 或 N%（0~100），非法时在参数解析阶段报错"""
+    value = value.strip()
+    try:
+        if value.endswith("%"):
+            percent = float(value[:-1])
+            if not 0 < percent <= 100:
+                raise ValueError(value)
+        else:
+            parse_size(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"无效的 --min-free: {value}，应为 N[KMGT] 或 N%")
+    return value
+
+def get_binary_logs(master_conn: pymysql.Connection) -> List[Dict[str, Any]]:
+    """SHOW BINARY LOGS，返回 [{"Log_name": ..., "File_size": ...}, ...]，从旧到新"""
+    with master_conn.cursor() as cursor:
+        cursor.execute("SHOW BINARY LOGS")
+        return cursor.fetchall()
+
+def get_pending_io(master_conn: pymysql.Connection) -> Optional[int]:
+    """主库InnoDB挂起的读写/fsync数，作为I/O负载指标；查询失败返回None"""
+    try:
+        with master_conn.cursor() as cursor:
+            cursor.execute("""
+                SHOW GLOBAL STATUS WHERE Variable_name IN
+                ('Innodb_data_pending_reads', 'Innodb_data_pending_writes',
+                 'Innodb_data_pending_fsyncs', 'Innodb_os_log_pending_fsyncs')
+            """)
+            return sum(int(row["Value"]) for row in cursor.fetchall())
+    except pymysql.Error as e:
+        logging.error(f"获取主库挂起I/O失败: {e}")
+        return None
+
+class ReplicaLagChecker:
+    """检查备库复制延迟，到各备库的连接在多次检查之间复用"""
+
+    def __init__(self, replica_ips: List[str]):
+        self.replica_ips = replica_ips
+        self._conns: Dict[str, pymysql.Connection] = {}
+
+    def _status(self, ip: str) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        """返回 (SHOW SLAVE STATUS, 错误信息)"""
+        conn = self._conns.get(ip)
+        if conn is None:
+            conn = connect_mysql(ip)
+            if not conn:
+                return None, f"备库 {ip} 无法连接"
+            self._conns[ip] = conn
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SHOW SLAVE STATUS")
+                return cursor.fetchone(), None
+        except pymysql.Error as e:
+            # 连接可能已失效，下次检查重新连接
+            self._conns.pop(ip, None)
+            conn.close()
+            return None, f"备库 {ip} 获取复制状态失败: {e}"
+
+    def max_lag(self) -> Tuple[Optional[int], Optional[str]]:
+        """返回 (所有备库中最大的Seconds_Behind_Master, 错误信息)
+
+        备库无法连接、复制已撤销或IO/SQL线程停止（延迟未知）时返回错误信息，
+        这种情况等待不会自行恢复，调用方应直接停止清理。
+        """
+        max_lag = 0
+        for ip in self.replica_ips:
+            status, error = self._status(ip)
+            if error:
+                return None, error
+            if not status:
+                return None, f"备库 {ip} 已没有复制配置"
+            lag = status.get("Seconds_Behind_Master")
+            if lag is None:
+                return None, (f"备库 {ip} 复制延迟未知: Slave_IO_Running={status.get('Slave_IO_Running')}, "
+                              f"Slave_SQL_Running={status.get('Slave_SQL_Running')}, "
+                              f"错误={status.get('Last_SQL_Error') or status.get('Last_IO_Error')}")
+            max_lag = max(max_lag, int(lag))
+        return max_lag, None
+
+    def close(self):
+        for conn in self._conns.values():
+            conn.close()
+        self._conns.clear()
+
+def wait_until_idle(master_conn: pymysql.Connection, lag_checker: Optional[ReplicaLagChecker],
+                    max_pending_io: int, max_lag: int, deadline: Optional[float] = None) -> bool:
+    """主库I/O负载或备库延迟超过阈值时暂停，恢复正常返回True
+
+    超过最长暂停时间或deadline、主库I/O查询失败、备库复制停止或无法连接时返回False。
+    """
+    paused = 0
+    while True:
+        pending_io = get_pending_io(master_conn)
+        if pending_io is None:
+            logging.error("无法获取主库I/O负载，停止本次清理")
+            return False
+        lag, error = lag_checker.max_lag() if lag_checker else (0, None)
+        if error:
+            logging.error(f"{error}，停止本次清理")
+            return False
+        if pending_io <= max_pending_io and lag <= max_lag:
+            return True
+        if paused >= MAX_PURGE_PAUSE:
+            logging.error(f"暂停超过 {MAX_PURGE_PAUSE}s 仍未恢复，停止本次清理")
+            return False
+        if deadline is not None and time.time() + PURGE_PAUSE_INTERVAL > deadline:
+            logging.error("暂停将超过处理时限，停止本次清理")
+            return False
+        logging.warning(f"主库挂起I/O {pending_io}，备库最大延迟 {lag}，暂停 {PURGE_PAUSE_INTERVAL}s")
+        time.sleep(PURGE_PAUSE_INTERVAL)
+        paused += PURGE_PAUSE_INTERVAL
+
+def get_binlog_dir(master_conn: pymysql.Connection) -> str:
+    """主库二进制日志所在目录，取 @@log_bin_basename 的目录，未设置时用 @@datadir"""
+    with master_conn.cursor() as cursor:
+        cursor.execute("SELECT @@log_bin_basename AS basename, @@datadir AS datadir")
+        row = cursor.fetchone()
+    if row["basename"]:
+        return os.path.dirname(row["basename"])
+    return row["datadir"]
+
+def get_disk_usage(host: str, path: str) -> Optional[Tuple[int, int]]:
+    """通过ssh在远程执行df，返回 path 所在文件系统的 (总字节数, 可用字节数)"""
+    try:
+        code, output = run_remote(f"df -P -B1 {shlex.quote(path)}", host, timeout=30)
+    except (ConnectionError, subprocess.TimeoutExpired) as e:
+        logging.error(f"获取磁盘空间失败 {host}:{path}: {e}")
+        return None
+    lines = output.strip().splitlines()
+    if code != 0 or len(lines) < 2:
+        logging.error(f"获取磁盘空间失败 {host}:{path}: {output.strip()}")
+        return None
+    fields = lines[-1].split()
+    return int(fields[1]), int(fields[3])
+
+def compute_disk_budget_target(master_conn: pymysql.Connection, master_ip: str,
+                               safe_file: str, min_free: str) -> Optional[str]:
+    """按磁盘预算计算purge目标：只清理最旧的、刚好够让可用空间达到 min_free 的日志
+
+    min_free 可以是大小（如 200G）或总空间的百分比（如 20%）。结果不会超过备库安全位点
+    safe_file；空间已满足时返回None。
+    """
+    try:
+        binlog_dir = get_binlog_dir(master_conn)
+        logs = get_binary_logs(master_conn)
+    except pymysql.Error as e:
+        logging.error(f"获取二进制日志信息失败: {e}")
+        return None
+    usage = get_disk_usage(master_ip, binlog_dir)
+    if not usage:
+        return None
+    total, avail = usage
+
+    if min_free.strip().endswith("%"):
+        min_free_bytes = int(total * float(min_free.strip()[:-1]) / 100)
+    else:
+        min_free_bytes = parse_size(min_free)
+    need = min_free_bytes - avail
+    logging.info(f"{master_ip}:{binlog_dir} 总空间 {total}，可用 {avail}，目标可用 {min_free_bytes}")
+    if need <= 0:
+        logging.info("磁盘可用空间已满足预算，不需要清理")
+        return None
+
+    names = [row["Log_name"] for row in logs]
+    if safe_file not in names:
+        logging.error(f"主库上不存在二进制日志文件: {safe_file}")
+        return None
+    # PURGE TO x 删除 x 之前的文件，最多清理到安全位点 safe_file
+    limit = names.index(safe_file)
+    freed = 0
+    end = 0
+    while end < limit and freed < need:
+        freed += int(logs[end]["File_size"])
+        end += 1
+    if end == 0:
+        logging.warning("安全位点之前没有可清理的日志")
+        return None
+    if freed < need:
+        logging.warning(f"清理到安全位点 {safe_file} 只能释放 {freed} 字节，仍不足 {need} 字节")
+    else:
+        logging.info(f"清理最旧的 {end} 个文件可释放 {freed} 字节，满足预算")
+    return names[end]
+
+def _purge_to(master_conn: pymysql.Connection, binlog_file: str) -> bool:
+    """在主库执行一次purge binary logs命令"""
     try:
         with master_conn.cursor() as cursor:
             purge_cmd = f"PURGE BINARY LOGS TO '{binlog_file}'"
             logging.info(f"执行命令: {purge_cmd}")
             # cursor.execute(purge_cmd)
             logging.info("二进制日志清理成功")
+            return True
     except pymysql.Error as e:
         logging.error(f"执行purge binary logs失败: {e}")
+        return False
 
-def main():
-    parser = argparse.ArgumentParser(description="MySQL二进制日志清理工具")
-    parser.add_argument("ip", help="MySQL服务器IP地址")
-    args = parser.parse_args()
-    
-    logging.info("="*50)
-    logging.info(f"开始处理IP: {args.ip}")
-    
-    # 步骤1: 递归向上查找主库
-    master_ip = find_master_recursive(args.ip)
+def purge_binary_logs(master_conn: pymysql.Connection, binlog_file: str,
+                      step_files: int = 0, bytes_per_sec: int = 0,
+                      replica_ips: Optional[List[str]] = None,
+                      max_pending_io: int = DEFAULT_MAX_PENDING_IO,
+                      max_lag: int = DEFAULT_MAX_REPLICA_LAG,
+                      deadline: Optional[float] = None) -> bool:
+    """在主库执行purge binary logs命令，全部清理完成返回True
+
+    step_files<=0 时一次性清理到 binlog_file；否则按 SHOW BINARY LOGS 的顺序每次前移
+    step_files 个文件，并按文件大小控制删除速度不超过 bytes_per_sec（0为不限速）。
+    每一步之前检查主库挂起I/O和备库延迟，超过阈值则暂停等待；到达 deadline 后不再继续。
+    """
+    if step_files <= 0:
+        return _purge_to(master_conn, binlog_file)
+
+    try:
+        logs = get_binary_logs(master_conn)
+    except pymysql.Error as e:
+        logging.error(f"获取二进制日志列表失败: {e}")
+        return False
+    names = [row["Log_name"] for row in logs]
+    if binlog_file not in names:
+        logging.error(f"主库上不存在二进制日志文件: {binlog_file}")
+        return False
+
+    # PURGE TO x 删除 x 之前的文件，不含 x 本身
+    target = names.index(binlog_file)
+    total_bytes = sum(int(row["File_size"]) for row in logs[:target])
+    logging.info(f"分批清理 {target} 个文件共 {total_bytes} 字节，每批 {step_files} 个，限速 {bytes_per_sec} B/s")
+
+    lag_checker = ReplicaLagChecker(replica_ips) if replica_ips else None
+    try:
+        done = 0
+        while done < target:
+            if deadline is not None and time.time() >= deadline:
+                logging.error(f"超过处理时限，已清理到 {names[done]}，停止分批清理")
+                return False
+            if not wait_until_idle(master_conn, lag_checker, max_pending_io, max_lag, deadline):
+                return False
+            end = min(done + step_files, target)
+            step_bytes = sum(int(row["File_size"]) for row in logs[done:end])
+            started = time.time()
+            if not _purge_to(master_conn, names[end]):
+                return False
+            done = end
+            if bytes_per_sec > 0:
+                delay = step_bytes / bytes_per_sec - (time.time() - started)
+                if delay > 0 and done < target:
+                    time.sleep(delay)
+    finally:
+        if lag_checker:
+            lag_checker.close()
+    logging.info(f"分批清理完成，共删除 {total_bytes} 字节")
+    return True
+
+def get_cmdb_clusters() -> Optional[Dict[str, List[str]]]:
+    """从CMDB列出所有集群及其实例ip，{cluster_name: [ip, ...]}，主库角色的实例排在前面，失败返回None"""
+    try:
+        return cmdb.get_cmdb_clusters(MYSQL_CONFIG)
+    except pymysql.Error as e:
+        logging.error(f"查询CMDB集群列表失败: {e}")
+        return None
+
+def clean_cluster(ip: str, args: argparse.Namespace, cmdb_ips: Optional[Set[str]] = None,
+                  deadline: Optional[float] = None, fallback_ips: Optional[List[str]] = None) -> Dict[str, Any]:
+    """对 ip 所在集群执行 发现 -> 计算安全位点 -> purge 的完整流程
+
+    cmdb_ips 为空时从CMDB查询。ip 无法连接时依次改用 fallback_ips 作为发现入口。
+    返回结果字典，status 为 purged/skipped/failed/timeout。
+    """
+    result = {"ip": ip, "master": None, "target": None, "status": "failed", "message": ""}
+
+    def _timeout(stage):
+        if deadline is not None and time.time() >= deadline:
+            result["status"] = "timeout"
+            result["message"] = f"{stage}前超过处理时限"
+            logging.error(result["message"])
+            return True
+        return False
+
+    # 步骤1: 并发发现复制拓扑，每个节点只连接一次
+    discovery = ReplicationDiscovery()
+    for entry_ip in [ip] + [x for x in (fallback_ips or []) if x != ip]:
+        if entry_ip in discovery.nodes and not discovery.nodes[entry_ip]["reachable"]:
+            continue
+        discovery.discover(entry_ip)
+        if discovery.nodes[entry_ip]["reachable"]:
+            break
+        logging.warning(f"入口节点 {entry_ip} 无法连接，尝试下一个CMDB实例")
+        if _timeout("发现拓扑"):
+            return result
+    ip = entry_ip
+    result["ip"] = ip
+    master_ip = discovery.find_master(ip)
     if not master_ip:
-        logging.error("无法找到主库")
-        return
+        result["message"] = "无法找到主库"
+        logging.error(result["message"])
+        return result
     
+    result["master"] = master_ip
     logging.info(f"最终主库IP: {master_ip}")
     
-    # 步骤2: 连接到主库并检查是否可写
-    master_conn = connect_mysql(master_ip)
+    # 步骤2: 检查主库是否可写（使用发现阶段缓存的read_only）
+    if discovery.nodes[master_ip]["read_only"]:
+        result["message"] = f"主库 {master_ip} 不可写"
+        logging.error(result["message"])
+        return result
+
+    master_conn = connect_mysql(master_ip, read_timeout=PURGE_READ_TIMEOUT)
     if not master_conn:
-        return
+        result["message"] = f"连接主库 {master_ip} 失败"
+        return result
     
     try:
-        if not is_master_writable(master_conn):
-            logging.error(f"主库 {master_ip} 不可写")
-            return
-        
-        # 步骤3: 递归向下查找所有备库
-        all_slaves = find_slaves_recursive(master_ip)
-        logging.info(f"找到所有备库: {all_slaves}")
-        
-        # 步骤4: 对每个备库获取Relay_Master_Log_File并处理
-        for slave_ip in all_slaves:
-            if slave_ip == master_ip:
-                continue
-                
-            slave_conn = connect_mysql(slave_ip)
-            if not slave_conn:
-                continue
-                
-            try:
-                relay_file = get_relay_master_log_file(slave_conn)
-                if not relay_file:
-                    logging.warning(f"备库 {slave_ip} 没有Relay_Master_Log_File")
-                    continue
-                
-                target_file = decrement_binlog_file(relay_file)
-                if target_file:
-                    purge_binary_logs(master_conn, target_file)
-            finally:
-                slave_conn.close()
-                
+        # 步骤3: 查询CMDB中登记的集群实例，包括当前未连接主库的备库
+        if cmdb_ips is None:
+            cmdb_ips = get_cmdb_cluster_ips(master_ip)
+        if cmdb_ips is None:
+            result["message"] = "无法获取CMDB集群实例，本次不清理"
+            logging.error(result["message"])
+            return result
+
+        # 步骤4: 取所有备库中最落后的位点，只执行一次purge
+        if _timeout("计算安全位点"):
+            return result
+        target_file = compute_safe_purge_target(discovery, master_ip, cmdb_ips)
+        if target_file and args.min_free:
+            target_file = compute_disk_budget_target(master_conn, master_ip, target_file, args.min_free)
+        if not target_file:
+            result["status"] = "skipped"
+            result["message"] = "没有需要清理的日志或无法确定安全位点"
+            return result
+
+        if _timeout("purge"):
+            return result
+        result["target"] = target_file
+        replica_ips = sorted(ip for ip in discovery.find_slaves(master_ip)
+                             if discovery.nodes[ip]["reachable"])
+        if purge_binary_logs(master_conn, target_file, step_files=args.step_files,
+                             bytes_per_sec=args.bytes_per_sec, replica_ips=replica_ips,
+                             max_pending_io=args.max_pending_io, max_lag=args.max_lag,
+                             deadline=deadline):
+            result["status"] = "purged"
+        elif deadline is not None and time.time() >= deadline:
+            result["status"] = "timeout"
+            result["message"] = "分批清理超过处理时限"
+        else:
+            result["message"] = "purge执行失败"
+        return result
     finally:
         master_conn.close()
+
+def clean_all_clusters(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    """批量模式：并发处理CMDB中的所有集群，每个集群有独立的处理时限"""
+    clusters = get_cmdb_clusters()
+    if clusters is None:
+        return []
+    logging.info(f"CMDB中共 {len(clusters)} 个集群，并发数 {args.parallel}，单集群时限 {args.cluster_timeout}s")
+
+    def _worker(cluster_name: str, ips: List[str]) -> Dict[str, Any]:
+        # 线程名用于日志格式中的 %(threadName)s，区分并发集群的日志；结束后还原，线程池复用时不串名
+        thread = threading.current_thread()
+        pool_name, thread.name = thread.name, cluster_name
+        started = time.time()
+        # 时限由各阶段之间的 deadline 检查和连接读写超时共同保证，处理始终占用一个并发名额
+        deadline = started + args.cluster_timeout
+        try:
+            result = clean_cluster(ips[0], args, cmdb_ips=set(ips), deadline=deadline, fallback_ips=ips[1:])
+        except Exception as e:
+            logging.exception(f"处理集群 {cluster_name} 异常")
+            result = {"ip": ips[0], "master": None, "target": None, "status": "failed", "message": str(e)}
+        finally:
+            thread.name = pool_name
+        result["cluster"] = cluster_name
+        result["elapsed"] = round(time.time() - started, 1)
+        logging.info(f"集群 {cluster_name} 处理结束: {result['status']} {result['message']}")
+        return result
+
+    with ThreadPoolExecutor(max_workers=args.parallel) as pool:
+        futures = [pool.submit(_worker, name, ips) for name, ips in clusters.items() if ips]
+        return [f.result() for f in futures]
+
+def print_summary(results: List[Dict[str, Any]]):
+    """打印并记录批量模式的汇总报告"""
+    counts: Dict[str, int] = {}
+    for r in results:
+        counts[r["status"]] = counts.get(r["status"], 0) + 1
+    lines = ["=" * 50, "批量清理汇总: " + ", ".join(f"{k}={v}" for k, v in sorted(counts.items()))]
+    for r in sorted(results, key=lambda r: (r["status"], r["cluster"])):
+        lines.append(f"{r['status']:<8} {r['cluster']:<30} master={r['master'] or '-':<16} "
+                     f"target={r['target'] or '-':<20} {r['elapsed']:>7}s {r['message']}")
+    for line in lines:
+        print(line)
+        logging.info(line)
+
+def main():
+    parser = argparse.ArgumentParser(description="MySQL二进制日志清理工具")
+    parser.add_argument("ip", nargs="?", help="MySQL服务器IP地址")
+    parser.add_argument("--all", action="store_true", help="批量模式：处理CMDB中的所有集群")
+    parser.add_argument("--parallel", type=int, default=DEFAULT_CLUSTER_PARALLEL,
+                        help=f"批量模式下并发处理的集群数，默认 {DEFAULT_CLUSTER_PARALLEL}")
+    parser.add_argument("--cluster-timeout", type=int, default=DEFAULT_CLUSTER_TIMEOUT,
+                        help=f"批量模式下单个集群的处理时限（秒），在各阶段之间检查，"
+                             f"进行中的查询受连接读写超时限制，默认 {DEFAULT_CLUSTER_TIMEOUT}")
+    parser.add_argument("--step-files", type=int, default=0,
+                        help="分批清理，每次前移的文件数；默认0为一次性清理")
+    parser.add_argument("--bytes-per-sec", type=parse_size, default=0,
+                        help="分批清理的删除速度上限，如 100M；默认不限速")
+    parser.add_argument("--max-pending-io", type=int, default=DEFAULT_MAX_PENDING_IO,
+                        help=f"主库InnoDB挂起I/O超过该值时暂停，默认 {DEFAULT_MAX_PENDING_IO}")
+    parser.add_argument("--max-lag", type=int, default=DEFAULT_MAX_REPLICA_LAG,
+                        help=f"备库延迟超过该秒数时暂停，默认 {DEFAULT_MAX_REPLICA_LAG}")
+    parser.add_argument("--min-free", type=min_free_arg, help="按磁盘预算清理：只清理到binlog所在磁盘可用空间达到该值，"
+                                           "如 200G 或 20%%；默认清理到备库安全位点")
+    args = parser.parse_args()
+    if not args.ip and not args.all:
+        parser.error("需要指定 ip 或 --all")
+    
+    logging.info("="*50)
+    if args.all:
+        logging.info("开始批量处理所有集群")
+        print_summary(clean_all_clusters(args))
+    else:
+        logging.info(f"开始处理IP: {args.ip}")
+        result = clean_cluster(args.ip, args)
+        logging.info(f"处理结束: {result['status']} {result['message']}")
+        if result["status"] in ("failed", "timeout"):
+            print(f"{result['status']}: {result['message']}")
+            sys.exit(1)
     
     logging.info("处理完成")
     logging.info("="*50)
@@ -1,16 +1,28 @@
+import argparse
 from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 import pymysql
 import sys
+import threading
+import time
 import os
 import json
 from dotenv import load_dotenv
 
+from cmdb import get_cmdb_clusters, save_json_atomic
+
 # 配置区：从环境变量加载
 load_dotenv()
 DB_USER = os.getenv('DB_USER', 'root')
 DB_PASSWORD = os.getenv('DB_PASSWORD')
 DB_PORT = int(os.getenv('DB_PORT', '3306'))
 
+# 监控模式长连接的读写超时（秒），节点无响应时不会一直阻塞
+WATCH_IO_TIMEOUT = 3
+
+# 本地拓扑快照，供 --max-age 增量扫描使用
+SNAPSHOT_FILE = os.getenv('TOPOLOGY_SNAPSHOT', '/tmp/mysql_topology_snapshot.json')
+
 
 class TermColors:
     """终端颜色配置"""
@@ -24,33 +36,307 @@ class TermColors:
     BOLD = '\033[1m'
     ENDC = '\033[0m'
 
+def fetch_replica_status(cursor):
+    """读取复制状态，优先尝试 MySQL 8.0.22+ 新语法，失败则回退"""
+    try:
+        cursor.execute("SHOW REPLICA STATUS")
+        return cursor.fetchone()
+    except:
+        cursor.execute("SHOW SLAVE STATUS")
+        return cursor.fetchone()
+
+
+def fetch_replica_hosts(cursor):
+    """读取已注册的从库列表，优先尝试新语法，失败则回退"""
+    try:
+        cursor.execute("SHOW REPLICAS")
+        return cursor.fetchall()
+    except:
+        cursor.execute("SHOW SLAVE HOSTS")
+        return cursor.fetchall()
+
+
+def source_host(status):
+    """从复制状态中取上游主机，排除本地回环"""
+    if not status:
+        return None
+    m_host = status.get('Source_Host') or status.get('Master_Host')
+    if m_host and m_host not in ['127.0.0.1', 'localhost', '::1']:
+        return m_host
+    return None
+
+
+def replication_health(status):
+    """从同一次 SHOW REPLICA/SLAVE STATUS 结果中提取延迟、线程状态、GTID 集合和错误"""
+    if not status:
+        return None
+
+    def pick(new_name, old_name):
+        value = status.get(new_name)
+        return status.get(old_name) if value is None else value
+
+    lag = pick('Seconds_Behind_Source', 'Seconds_Behind_Master')
+    return {
+        "lag": None if lag is None else int(lag),
+        "io_running": pick('Replica_IO_Running', 'Slave_IO_Running'),
+        "sql_running": pick('Replica_SQL_Running', 'Slave_SQL_Running'),
+        # GTID 集合较长时 MySQL 会插入换行，这里去掉
+        "retrieved_gtid_set": (status.get('Retrieved_Gtid_Set') or '').replace('\n', ''),
+        "executed_gtid_set": (status.get('Executed_Gtid_Set') or '').replace('\n', ''),
+        "last_io_error": status.get('Last_IO_Error') or None,
+        "last_sql_error": status.get('Last_SQL_Error') or None,
+    }
+
+
+def replication_links(nodes, edges):
+    """把每个从库的复制健康信息挂到对应的边上，按延迟从高到低排序
+
+    复制中断（延迟为 NULL 或线程未运行）的链路排在最前面。
+    """
+    links = []
+    for u, v in edges:
+        health = (nodes.get(v) or {}).get('replication')
+        link = {"source": u, "replica": v}
+        if 'cached_age' in (nodes.get(v) or {}):
+            link["cached_age"] = nodes[v]['cached_age']
+        if health:
+            link.update(health)
+        else:
+            link.update({"lag": None, "io_running": None, "sql_running": None})
+        link["broken"] = bool(health) and (health["lag"] is None or health["io_running"] != 'Yes'
+                                           or health["sql_running"] != 'Yes')
+        links.append(link)
+    links.sort(key=lambda l: (not l["broken"], -(l["lag"] or 0), l["source"], l["replica"]))
+    return links
+
+
+class TopologyGraph:
+    """复制拓扑的索引图：邻接表 + 节点到环的映射
+
+    构建与环识别都是 O(节点数 + 边数)：环即节点数大于 1 的强连通分量
+    （Tarjan 算法，显式栈实现），因此任意长度的环形复制都能识别，双主是两节点的特例。
+    """
+
+    def __init__(self, nodes, edges):
+        self.children = defaultdict(list)  # parent -> [child, ...]
+        self.parents = defaultdict(list)   # child -> [parent, ...]
+        self.vertices = set(nodes)
+        for u, v in edges:
+            self.children[u].append(v)
+            self.parents[v].append(u)
+            self.vertices.add(u)
+            self.vertices.add(v)
+        self.rings = self._strongly_connected_rings()
+        self._ring_index = {}
+        for idx, ring in enumerate(self.rings):
+            for ip in ring:
+                self._ring_index[ip] = idx
+
+    def ring_of(self, ip):
+        """返回 ip 所在的环（节点元组），不在环中返回 None"""
+        idx = self._ring_index.get(ip)
+        return None if idx is None else self.rings[idx]
+
+    def in_same_ring(self, u, v):
+        idx = self._ring_index.get(u)
+        return idx is not None and idx == self._ring_index.get(v)
+
+    def _strongly_connected_rings(self):
+        """迭代版 Tarjan，返回所有节点数大于 1 的强连通分量"""
+        index = {}
+        low = {}
+        stack = []
+        on_stack = set()
+        rings = []
+        counter = 0
+        for root in self.vertices:
+            if root in index:
+                continue
+            index[root] = low[root] = counter
+            counter += 1
+            stack.append(root)
+            on_stack.add(root)
+            work = [(root, iter(self.children.get(root, ())))]
+            while work:
+                v, it = work[-1]
+                for w in it:
+                    if w not in index:
+                        index[w] = low[w] = counter
+                        counter += 1
+                        stack.append(w)
+                        on_stack.add(w)
+                        work.append((w, iter(self.children.get(w, ()))))
+                        break
+                    elif w in on_stack:
+                        low[v] = min(low[v], index[w])
+                else:
+                    work.pop()
+                    if work:
+                        parent = work[-1][0]
+                        low[parent] = min(low[parent], low[v])
+                    if low[v] == index[v]:
+                        component = []
+                        while True:
+                            w = stack.pop()
+                            on_stack.discard(w)
+                            component.append(w)
+                            if w == v:
+                                break
+                        if len(component) > 1:
+                            rings.append(tuple(sorted(component)))
+        return rings
+
+
 class TopologyScanner:
-    def __init__(self, user, password, port):
+    def __init__(self, user, password, port, max_workers=32, progress_stream=sys.stdout):
         self.user = user
         self.password = password
         self.port = port
+        self.max_workers = max_workers
+        self.progress_stream = progress_stream  # 扫描进度输出位置，None 为不输出
         self.nodes = {}       # 存储节点元数据
         self.edges = set()    # 存储拓扑关系 (parent, child)
-        self.visited = set()  # 防止递归死循环
+        self.visited = set()  # 已提交扫描的节点，防止重复扫描
         self.dual_masters = set() # 存储双主对
+        self._lock = threading.Lock()  # 保护 nodes/edges/visited，供扫描线程共享
+        # 本地快照：{ip: {"meta": {...}, "edges": [[u, v], ...], "scanned_at": ts}}
+        self.snapshot = {}
+        self.max_age = 0        # 快照有效期（秒），0 表示不使用快照，全部实时扫描
+        self._from_cache = set()  # 本次直接使用快照结果的节点
+        self._node_edges = {}     # 每个节点最近一次上报的边，用于重新扫描时替换旧关系
 
-    def get_conn(self, host):
+    def get_conn(self, host, read_timeout=None, write_timeout=None):
         return pymysql.connect(
             host=host, user=self.user, password=self.password, 
             port=self.port, connect_timeout=3, 
+            read_timeout=read_timeout, write_timeout=write_timeout,
             cursorclass=pymysql.cursors.DictCursor
         )
 
-    def scan(self, ip):
-        """递归扫描核心逻辑"""
-        if ip in self.visited:
-            return
-        self.visited.add(ip)
+    def load_snapshot(self, path, max_age):
+        """加载本地快照，max_age 秒内扫描过且无错误的非起始节点直接复用，不再连接
+
+        复用节点期间的复制关系变化无法感知，拓扑最多滞后 max_age 秒。
+        """
+        self.max_age = max_age
+        try:
+            with open(path, encoding='utf-8') as f:
+                self.snapshot = json.load(f).get('nodes', {})
+        except FileNotFoundError:
+            self.snapshot = {}
+        except (OSError, ValueError) as e:
+            sys.stderr.write(f"快照 {path} 读取失败，全部重新扫描: {e}\n")
+            self.snapshot = {}
+
+    def save_snapshot(self, path):
+        """把快照（含本次实时扫描的节点）原子写回本地文件"""
+        with self._lock:
+            save_json_atomic(path, {"version": 1, "saved_at": time.time(), "nodes": self.snapshot})
+
+    def _cached_entry(self, ip):
+        """返回仍在有效期内的快照条目；过期、出错或未启用快照时返回 None"""
+        if self.max_age <= 0:
+            return None
+        entry = self.snapshot.get(ip)
+        if not entry or 'error' in entry['meta']:
+            return None
+        if time.time() - entry['scanned_at'] > self.max_age:
+            return None
+        return entry
+
+    def scan(self, *ips, live=None):
+        """并发迭代扫描：从 ips 出发，由线程池并行探测节点，直到没有新节点
+
+        visited 在同一个 scanner 的多次（可并发的）scan 调用之间共享，已被其他调用
+        扫描过的节点不会重复连接。live 中的起始节点总是实时扫描，默认为全部 ips；
+        启用快照时，其余有效期内的
+        节点直接复用快照（不含复制延迟等实时状态，meta 中记录 cached_age）。实时扫描到
+        的复制关系与快照不一致时，关系变化涉及的节点即使快照未过期也会重新扫描；
+        复用节点自身的关系变化要等快照过期或被相邻节点触发后才能发现。
+
+        Returns:
+            (本次扫描的节点列表, 本次扫描到的边集合, 引用到但已由其他调用扫描的节点集合)
+        """
+        claimed = []
+        shared = set()
+        ready = []  # 直接来自快照、无需等待的结果
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            pending = {}
+
+            def submit(node_ip, force=False):
+                with self._lock:
+                    # 已用快照结果的节点在复制关系变化时允许重新实时扫描一次
+                    if node_ip in self.visited and not (force and node_ip in self._from_cache):
+                        if node_ip not in claimed:
+                            shared.add(node_ip)
+                        return
+                    self.visited.add(node_ip)
+                    if node_ip not in claimed:
+                        claimed.append(node_ip)
+                    entry = None if force else self._cached_entry(node_ip)
+                    if entry:
+                        self._from_cache.add(node_ip)
+                        meta = dict(entry['meta'])
+                        # 延迟、线程状态是扫描当时的值，复用时不当作当前状态展示
+                        meta.pop('replication', None)
+                        meta['cached_age'] = int(time.time() - entry['scanned_at'])
+                        self.nodes[node_ip] = meta
+                        node_edges = [tuple(e) for e in entry['edges']]
+                        self._set_node_edges(node_ip, node_edges)
+                    else:
+                        self._from_cache.discard(node_ip)
+                if entry:
+                    ready.append((node_ip, node_edges, False))
+                else:
+                    pending[pool.submit(self._scan_node, node_ip)] = node_ip
 
+            # 入口节点总是实时扫描，保证至少从入口处感知最新的复制关系
+            live = set(ips if live is None else live)
+            for ip in ips:
+                submit(ip, force=ip in live)
+            while pending or ready:
+                if not ready:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        node_ip = pending.pop(future)
+                        ready.append((node_ip, future.result()[1], True))
+                node_ip, node_edges, live = ready.pop()
+                forced = set()
+                if live:
+                    forced = self._changed_neighbors(node_ip, node_edges)
+                for u, v in node_edges:
+                    neighbor = u if v == node_ip else v
+                    submit(neighbor, force=neighbor in forced)
+                for neighbor in forced:
+                    submit(neighbor, force=True)
+        with self._lock:
+            edges = {e for ip in claimed for e in self._node_edges.get(ip, ())}
+        return claimed, edges, shared
+
+    def _changed_neighbors(self, ip, node_edges):
+        """实时扫描结果与快照对比，返回复制关系发生变化的相邻节点，并更新快照"""
+        with self._lock:
+            old = self.snapshot.get(ip)
+            old_edges = {tuple(e) for e in old['edges']} if old else set()
+            self.snapshot[ip] = {
+                'meta': self.nodes.get(ip, {'ip': ip}),
+                'edges': [list(e) for e in node_edges],
+                'scanned_at': time.time(),
+            }
+        if not old:
+            return set()
+        return {x for e in old_edges ^ set(node_edges) for x in e} - {ip}
+
+    def _scan_node(self, ip):
+        """探测单个节点，记录元数据和复制关系，返回 (需要继续扫描的相邻节点, 该节点相关的边)"""
         # 简单的进度打印
-        sys.stdout.write(f"\rScanning node: {ip} ...\033[K")
-        sys.stdout.flush()
+        if self.progress_stream:
+            with self._lock:
+                self.progress_stream.write(f"\rScanning node: {ip} ...\033[K")
+                self.progress_stream.flush()
 
+        neighbors = []
+        node_edges = []
         try:
             conn = self.get_conn(ip)
             with conn.cursor() as cursor:
@@ -59,61 +345,60 @@ class TopologyScanner:
                 meta = cursor.fetchone()
                 # 补充 IP 字段方便后续 JSON 序列化
                 meta['ip'] = ip
-                self.nodes[ip] = meta
+                with self._lock:
+                    self.nodes[ip] = meta
 
                 # 2. 向上探测 (Find Master)
-                # 优先尝试 MySQL 8.0.22+ 新语法，失败则回退
-                try:
-                    cursor.execute("SHOW REPLICA STATUS")
-                    m_status = cursor.fetchone()
-                except:
-                    cursor.execute("SHOW SLAVE STATUS")
-                    m_status = cursor.fetchone()
-                
-                if m_status:
-                    m_host = m_status.get('Source_Host') or m_status.get('Master_Host')
-                    # 排除本地回环
-                    if m_host and m_host not in ['127.0.0.1', 'localhost', '::1']:
-                        self.edges.add((m_host, ip))
-                        self.scan(m_host)
+                m_status = fetch_replica_status(cursor)
+                health = replication_health(m_status)
+                if health:
+                    with self._lock:
+                        meta['replication'] = health
+                m_host = source_host(m_status)
+                if m_host:
+                    node_edges.append((m_host, ip))
+                    neighbors.append(m_host)
 
                 # 3. 向下探测 (Find Slaves)
-                try:
-                    cursor.execute("SHOW REPLICAS")
-                    s_hosts = cursor.fetchall()
-                except:
-                    cursor.execute("SHOW SLAVE HOSTS")
-                    s_hosts = cursor.fetchall()
-
-                for s in s_hosts:
+                for s in fetch_replica_hosts(cursor):
                     s_ip = s['Host']
-                    self.edges.add((ip, s_ip))
-                    self.scan(s_ip)
+                    node_edges.append((ip, s_ip))
+                    neighbors.append(s_ip)
 
             conn.close()
         except Exception as e:
-            self.nodes[ip] = {'ip': ip, 'error': str(e), 'ro': -1, 'sid': -1}
+            with self._lock:
+                self.nodes[ip] = {'ip': ip, 'error': str(e), 'ro': -1, 'sid': -1}
+        with self._lock:
+            self._set_node_edges(ip, node_edges)
+        return neighbors, node_edges
+
+    def _set_node_edges(self, ip, node_edges):
+        """用节点最新上报的边替换旧上报，维护 self.edges；调用方需持有 self._lock
+
+        一条边 (u, v) 可能由 u 和 v 两端上报，只有两端都不再上报时才从 self.edges 中删除。
+        """
+        old = self._node_edges.get(ip, set())
+        new = set(node_edges)
+        for u, v in old - new:
+            other = u if v == ip else v
+            if (u, v) not in self._node_edges.get(other, ()):
+                self.edges.discard((u, v))
+        self.edges.update(new)
+        self._node_edges[ip] = new
 
     def analyze(self):
-        """分析拓扑结构，提取双主和树形关系"""
-        # 1. 识别双主 (A->B 且 B->A)
-        for u, v in self.edges:
-            if (v, u) in self.edges:
-                pair = tuple(sorted((u, v)))
-                self.dual_masters.add(pair)
+        """分析拓扑结构：构建索引图，识别环形复制（含双主），提取树形关系"""
+        self.graph = TopologyGraph(self.nodes, self.edges)
+        self.rings = self.graph.rings
+        # 双主即两节点的环，保留该字段兼容原有 JSON 输出
+        self.dual_masters = {ring for ring in self.rings if len(ring) == 2}
 
-        # 2. 构建邻接表 (用于树形打印)
+        # 构建邻接表 (用于树形打印)；同一个环内的边在画树时切断，避免死循环打印
         self.tree_map = defaultdict(list)
         self.children_set = set()
-        
         for u, v in self.edges:
-            # 如果是双主关系，在画树时切断循环，避免死循环打印
-            is_dual_link = False
-            for dm in self.dual_masters:
-                if u in dm and v in dm:
-                    is_dual_link = True
-            
-            if not is_dual_link:
+            if not self.graph.in_same_ring(u, v):
                 self.tree_map[u].append(v)
                 self.children_set.add(v)
 
@@ -135,27 +420,56 @@ class TopologyScanner:
             color = TermColors.OKGREEN
             role = "RW"
 
-        # 检查是否为双主
-        dm_flag = ""
-        for pair in self.dual_masters:
-            if ip in pair:
-                icon = "♻️ " # 循环标志
-                color = TermColors.WARNING
-                dm_flag = f" {TermColors.BOLD}[双主]{TermColors.ENDC}"
+        # 检查是否在环形复制中（两节点即双主）
+        ring_flag = ""
+        ring = self.graph.ring_of(ip)
+        if ring:
+            icon = "♻️ " # 循环标志
+            color = TermColors.WARNING
+            if len(ring) == 2:
+                ring_flag = f" {TermColors.BOLD}[双主]{TermColors.ENDC}"
                 role = "MM"
+            else:
+                ring_flag = f" {TermColors.BOLD}[环形复制:{len(ring)}节点]{TermColors.ENDC}"
+                role = "RING"
 
-        return f"{color}{icon} {ip}{TermColors.ENDC} ({role}, id:{info.get('sid')}){dm_flag}"
+        lag_flag = ""
+        health = info.get('replication')
+        if health:
+            if health['lag'] is None or health['io_running'] != 'Yes' or health['sql_running'] != 'Yes':
+                lag_flag = f" {TermColors.FAIL}[复制中断 IO:{health['io_running']} SQL:{health['sql_running']}]{TermColors.ENDC}"
+            elif health['lag'] > 0:
+                lag_flag = f" {TermColors.WARNING}lag:{health['lag']}s{TermColors.ENDC}"
+
+        cache_flag = ""
+        if 'cached_age' in info:
+            cache_flag = f" {TermColors.GREY}[快照 {info['cached_age']}s 前]{TermColors.ENDC}"
+
+        return f"{color}{icon} {ip}{TermColors.ENDC} ({role}, id:{info.get('sid')}){ring_flag}{lag_flag}{cache_flag}"
 
     def print_tree_recursive(self, root, prefix=""):
-        print(f"{prefix}{self._print_node(root)}")
-        children = self.tree_map.get(root, [])
+        """打印以 root 为根的子树"""
+        self._print_subtree([(root, prefix, "", prefix)])
+
+    def _print_children(self, root, prefix):
+        """只打印 root 的子树，不打印 root 自身"""
+        self._print_subtree(self._child_entries(root, prefix))
+
+    def _child_entries(self, node, prefix):
+        children = self.tree_map.get(node, [])
         count = len(children)
-        for i, child in enumerate(children):
-            is_last = (i == count - 1)
-            marker = "└── " if is_last else "├── "
-            new_prefix = prefix + ("    " if is_last else "│   ")
-            sys.stdout.write(prefix + marker)
-            self.print_tree_recursive(child, new_prefix)
+        return [(c, prefix, "└── " if i == count - 1 else "├── ",
+                 prefix + ("    " if i == count - 1 else "│   "))
+                for i, c in enumerate(children)]
+
+    def _print_subtree(self, entries):
+        """用显式栈代替递归打印，长级联链也不会超过递归深度"""
+        # 逆序入栈，保证按原顺序输出
+        stack = entries[::-1]
+        while stack:
+            node, line_prefix, marker, child_prefix = stack.pop()
+            print(f"{line_prefix}{marker}{self._print_node(node)}")
+            stack.extend(self._child_entries(node, child_prefix)[::-1])
 
     def render_terminal(self):
         """打印人类可读的终端图形"""
@@ -163,48 +477,34 @@ class TopologyScanner:
         sys.stdout.write("\r" + " " * 50 + "\r") # 清除进度条
         print(f"\n{TermColors.HEADER}=== MySQL 拓扑结构 ==={TermColors.ENDC}\n")
 
-        # 寻找根节点：不在"孩子集合"中的节点，或者是双主之一
-        # 注意：双主中的节点互为父子，如果不处理会被漏掉。
-        # 逻辑：先处理双主，再处理剩下的独立树。
+        # 寻找根节点：不在"孩子集合"中的节点，或者是环中节点
+        # 注意：环中的节点互为父子，如果不处理会被漏掉。
+        # 逻辑：先处理双主/环形复制，再处理剩下的独立树。
         
         processed_roots = set()
 
-        # 1. 优先展示双主架构
-        if self.dual_masters:
-            print(f"{TermColors.BOLD}>>> 检测到双主 (Master-Master) 架构:{TermColors.ENDC}")
-            for m1, m2 in self.dual_masters:
-                # 简单的双主并列展示
-                print(f" ┌─ {self._print_node(m1)}")
-                print(f" ║  (同步复制)")
-                print(f" └─ {self._print_node(m2)}")
-                
-                # 打印挂在 m1 下面的从库
-                if self.tree_map[m1]:
-                    print(f"    └─ [挂载于 {m1}]")
-                    self.print_tree_recursive(m1, prefix="       ") # m1 的子树其实应该跳过自身
-                    # 修正：上面的递归会把m1自己打印一遍，这里需要特殊处理
-                    # 简单起见，我们直接遍历 m1 的 children 打印
-                    children = self.tree_map[m1]
-                    for idx, c in enumerate(children):
-                         marker = "└── " if idx == len(children)-1 else "├── "
-                         sys.stdout.write("       " + marker)
-                         self.print_tree_recursive(c, "           ")
-
-                # 打印挂在 m2 下面的从库
-                if self.tree_map[m2]:
-                    print(f"    └─ [挂载于 {m2}]")
-                    children = self.tree_map[m2]
-                    for idx, c in enumerate(children):
-                         marker = "└── " if idx == len(children)-1 else "├── "
-                         sys.stdout.write("       " + marker)
-                         self.print_tree_recursive(c, "           ")
+        # 1. 优先展示双主/环形复制架构
+        if self.rings:
+            print(f"{TermColors.BOLD}>>> 检测到双主 (Master-Master) / 环形复制架构:{TermColors.ENDC}")
+            for ring in self.rings:
+                for idx, member in enumerate(ring):
+                    if idx == 0:
+                        print(f" ┌─ {self._print_node(member)}")
+                    else:
+                        print(f" ║  (同步复制)")
+                        print(f" {'└' if idx == len(ring) - 1 else '├'}─ {self._print_node(member)}")
+
+                # 打印挂在每个环成员下面的从库
+                for member in ring:
+                    if self.tree_map.get(member):
+                        print(f"    └─ [挂载于 {member}]")
+                        self._print_children(member, "       ")
                 
                 print("")
-                processed_roots.add(m1)
-                processed_roots.add(m2)
+                processed_roots.update(ring)
 
         # 2. 展示普通的一主多从 (Standard Master-Slave)
-        # 根节点 = 所有节点 - 所有子节点 - 已经处理过的双主节点
+        # 根节点 = 所有节点 - 所有子节点 - 已经处理过的环节点
         potential_roots = set(self.nodes.keys()) - self.children_set - processed_roots
         
         if potential_roots:
@@ -219,26 +519,282 @@ class TopologyScanner:
             "summary": {
                 "total_nodes": len(self.nodes),
                 "dual_master_detected": len(self.dual_masters) > 0,
-                "dual_master_pairs": list(self.dual_masters)
+                "dual_master_pairs": list(self.dual_masters),
+                "rings": [list(ring) for ring in self.rings]
             },
             "topology_edges": list(self.edges),
+            "replication_links": replication_links(self.nodes, self.edges),
             "nodes_detail": self.nodes
         }
         return json.dumps(output, indent=2, ensure_ascii=False)
 
+    def render_hotspots(self, top=10):
+        """按复制延迟排序展示最慢的链路（中断的链路排在最前）"""
+        links = [l for l in replication_links(self.nodes, self.edges) if l["broken"] or l["lag"]]
+        print(f"{TermColors.HEADER}=== 复制延迟热点 (Top {top}) ==={TermColors.ENDC}")
+        if not links:
+            print(f" {TermColors.OKGREEN}所有复制链路无延迟{TermColors.ENDC}\n")
+            return
+        for l in links[:top]:
+            if l["broken"]:
+                error = l.get("last_io_error") or l.get("last_sql_error") or ""
+                print(f" {TermColors.FAIL}[中断] {l['source']} -> {l['replica']} "
+                      f"IO:{l['io_running']} SQL:{l['sql_running']} {error}{TermColors.ENDC}")
+            else:
+                color = TermColors.FAIL if l["lag"] >= 60 else TermColors.WARNING
+                print(f" {color}{l['lag']:>6}s{TermColors.ENDC}  {l['source']} -> {l['replica']}")
+        print("")
+
+class TopologyWatcher:
+    """持续监控模式：对已扫描节点保持长连接，按间隔轮询复制状态并输出变化事件
+
+    只输出变化，不重绘整棵树。事件类型：
+      new_replica / replica_gone      从库注册或消失（新从库会自动加入监控）
+      source_change                   复制源变化
+      read_only_flip                  read_only 变化
+      replication_broken / replication_recovered  IO/SQL 线程停止或恢复
+      node_down / node_up             节点连接断开或恢复
+    """
+
+    def __init__(self, scanner, interval=1.0, out=sys.stdout):
+        self.scanner = scanner
+        self.interval = interval
+        self.out = out
+        self.conns = {}   # ip -> 长连接
+        self.state = {}   # ip -> 最近一次成功轮询的状态
+        self.down = set()  # 当前连接失败的节点
+        self.watching = [ip for ip, meta in scanner.nodes.items() if 'error' not in meta]
+        self.inflight = {}  # ip -> 尚未返回的轮询，未返回前不会在同一连接上再次提交
+
+    def emit(self, event_type, ip, **detail):
+        event = {"ts": round(time.time(), 3), "type": event_type, "ip": ip}
+        event.update(detail)
+        self.out.write(json.dumps(event, ensure_ascii=False, default=str) + "\n")
+        self.out.flush()
+
+    def poll_node(self, ip):
+        """在长连接上读取一次节点状态，连接失败时关闭连接并返回 None"""
+        try:
+            conn = self.conns.get(ip)
+            if conn is None:
+                conn = self.conns[ip] = self.scanner.get_conn(
+                    ip, read_timeout=WATCH_IO_TIMEOUT, write_timeout=WATCH_IO_TIMEOUT)
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT @@read_only as ro")
+                ro = cursor.fetchone()['ro']
+                status = fetch_replica_status(cursor)
+                replicas = {s['Host'] for s in fetch_replica_hosts(cursor)}
+        except Exception as e:
+            conn = self.conns.pop(ip, None)
+            if conn is not None:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+            return {"error": str(e)}
+
+        state = {"ro": ro, "source": source_host(status), "replicas": replicas,
+                 "io": None, "sql": None, "error_msg": None}
+        if status:
+            state["io"] = status.get('Replica_IO_Running') or status.get('Slave_IO_Running')
+            state["sql"] = status.get('Replica_SQL_Running') or status.get('Slave_SQL_Running')
+            state["error_msg"] = (status.get('Last_IO_Error') or status.get('Last_SQL_Error')
+                                  or status.get('Last_Error'))
+        return state
+
+    def diff(self, ip, old, new):
+        """对比本次轮询结果与最近一次成功的状态 old 并输出事件
+
+        节点断开期间发生的 read_only、复制源等变化在恢复时与断开前的状态比较，不会丢失。
+        """
+        if 'error' in new:
+            if ip not in self.down:
+                self.down.add(ip)
+                self.emit("node_down", ip, error=new['error'])
+            return
+        if ip in self.down:
+            self.down.discard(ip)
+            self.emit("node_up", ip)
+        if old is None:
+            return
+
+        for r in sorted(new["replicas"] - old["replicas"]):
+            self.emit("new_replica", ip, replica=r)
+        for r in sorted(old["replicas"] - new["replicas"]):
+            self.emit("replica_gone", ip, replica=r)
+        if new["source"] != old["source"]:
+            self.emit("source_change", ip, old_source=old["source"], new_source=new["source"])
+        if new["ro"] != old["ro"]:
+            self.emit("read_only_flip", ip, old_ro=old["ro"], new_ro=new["ro"])
+
+        was_ok = old["io"] in (None, 'Yes') and old["sql"] in (None, 'Yes')
+        is_ok = new["io"] in (None, 'Yes') and new["sql"] in (None, 'Yes')
+        if was_ok and not is_ok:
+            self.emit("replication_broken", ip, io=new["io"], sql=new["sql"], error=new["error_msg"])
+        elif not was_ok and is_ok:
+            self.emit("replication_recovered", ip)
+
+    def poll_once(self, pool):
+        """并发轮询所有监控中的节点一次，返回本轮新发现的从库
+
+        每轮最多等待 interval 秒，未按时返回的节点本轮不输出事件，也不拖慢其他节点；
+        其轮询返回前不会重复提交。连接设置了读写超时，轮询最终会返回结果或报错，
+        只有真正的连接错误或超时才记为 node_down。
+        """
+        watching = list(self.watching)
+        futures = {}
+        for ip in watching:
+            future = self.inflight.get(ip)
+            if future is None or future.done():
+                future = self.inflight[ip] = pool.submit(self.poll_node, ip)
+            futures[ip] = future
+        wait(futures.values(), timeout=self.interval)
+
+        discovered = []
+        for ip in watching:
+            future = futures[ip]
+            if not future.done():
+                continue
+            del self.inflight[ip]
+            new = future.result()
+            if ip not in self.state and ip not in self.down:
+                # 首次轮询只建立基准，不输出事件
+                if 'error' in new:
+                    self.down.add(ip)
+                else:
+                    self.state[ip] = new
+                continue
+            self.diff(ip, self.state.get(ip), new)
+            if 'error' not in new:
+                self.state[ip] = new
+                discovered.extend(r for r in new["replicas"]
+                                  if r not in self.state and r not in self.down)
+        return discovered
+
+    def run(self, rounds=None):
+        """按 interval 持续轮询；rounds 为空时一直运行直到中断"""
+        count = 0
+        with ThreadPoolExecutor(max_workers=self.scanner.max_workers) as pool:
+            try:
+                while rounds is None or count < rounds:
+                    started = time.time()
+                    for ip in self.poll_once(pool):
+                        if ip not in self.watching:
+                            self.watching.append(ip)
+                    count += 1
+                    time.sleep(max(0.0, self.interval - (time.time() - started)))
+            finally:
+                for conn in self.conns.values():
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+                self.conns.clear()
+
+
+def scan_fleet(scanner, clusters, out, parallel=8):
+    """全量扫描：以 CMDB 中每个集群的实例为种子并发扫描，共享 visited 集合
+
+    每个集群扫描完成后立即向 out 写出一行 JSON（NDJSON），不在内存中拼装整体结果。
+    被其他集群先行扫描过的节点只出现在 shared_nodes 中，不会重复连接。
+    启用快照时每个集群只有第一个种子（CMDB 中的主库）实时扫描，其余种子与普通节点一样
+    在有效期内复用快照。
+
+    Returns:
+        写出的集群数。
+    """
+    write_lock = threading.Lock()
+
+    def scan_cluster(name, seeds):
+        started = time.time()
+        scanned, edges, shared = scanner.scan(*seeds, live=seeds[:1])
+        with scanner._lock:
+            nodes = {ip: scanner.nodes.get(ip) for ip in scanned}
+        rings = TopologyGraph(nodes, edges).rings
+        record = {
+            "cluster": name,
+            "seeds": seeds,
+            "total_nodes": len(nodes),
+            "error_nodes": sorted(ip for ip, meta in nodes.items() if meta and 'error' in meta),
+            "rings": [list(ring) for ring in rings],
+            "topology_edges": sorted(edges),
+            "replication_links": replication_links(nodes, edges),
+            "shared_nodes": sorted(shared),
+            "nodes_detail": nodes,
+            "elapsed": round(time.time() - started, 3),
+        }
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        with write_lock:
+            out.write(line + "\n")
+            out.flush()
+
+    with ThreadPoolExecutor(max_workers=parallel) as pool:
+        futures = [pool.submit(scan_cluster, name, seeds) for name, seeds in clusters.items()]
+        for future in futures:
+            future.result()
+    return len(futures)
+
+
 def main():
-    if len(sys.argv) < 2:
+    parser = argparse.ArgumentParser(description="MySQL 复制拓扑扫描")
+    parser.add_argument("ip", nargs="?", help="从该 IP 开始扫描")
+    parser.add_argument("--fleet", action="store_true",
+                        help="全量模式：以 CMDB mysql_cluster 各集群在 mysql_cluster_instance 登记的所有 IP 为种子，"
+                             "逐集群输出 NDJSON")
+    parser.add_argument("--parallel", type=int, default=8, help="全量模式下并发扫描的集群数，默认 8")
+    parser.add_argument("--output", help="全量模式 NDJSON 输出文件，默认标准输出")
+    parser.add_argument("--watch", action="store_true",
+                        help="持续监控模式：扫描后保持长连接轮询复制状态，以 NDJSON 输出变化事件")
+    parser.add_argument("--interval", type=float, default=1.0, help="监控模式的轮询间隔（秒），默认 1")
+    parser.add_argument("--hotspots", type=int, default=10,
+                        help="在拓扑图后展示延迟最高的 N 条复制链路，默认 10，0 为不展示")
+    parser.add_argument("--snapshot", default=SNAPSHOT_FILE, help=f"本地拓扑快照文件，默认 {SNAPSHOT_FILE}")
+    parser.add_argument("--max-age", type=int, default=0,
+                        help="快照有效期（秒）：起始节点（全量模式下为每个集群的第一个种子）总是实时连接，其余节点在有效期内直接复用快照、不再连接，"
+                             "因此拓扑最多可能滞后 max-age 秒（例如期间新挂到复用节点下的从库不会被发现）；"
+                             "复用节点标注快照时间且不展示延迟。默认 0 全部重新扫描")
+    args = parser.parse_args()
+
+    if args.fleet:
+        # 进度输出到 stderr，避免混入 NDJSON
+        scanner = TopologyScanner(DB_USER, DB_PASSWORD, DB_PORT, max_workers=8, progress_stream=sys.stderr)
+        scanner.load_snapshot(args.snapshot, args.max_age)
+        clusters = get_cmdb_clusters()
+        out = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+        try:
+            count = scan_fleet(scanner, clusters, out, parallel=args.parallel)
+        finally:
+            if args.output:
+                out.close()
+        scanner.save_snapshot(args.snapshot)
+        sys.stderr.write(f"\r\033[K扫描完成: {count} 个集群, {len(scanner.nodes)} 个节点\n")
+        return
+
+    if not args.ip:
         print("Usage: python3 topology.py <IP_ADDRESS>")
         sys.exit(1)
 
-    target_ip = sys.argv[1]
-    scanner = TopologyScanner(DB_USER, DB_PASSWORD, DB_PORT)
+    target_ip = args.ip
+    scanner = TopologyScanner(DB_USER, DB_PASSWORD, DB_PORT,
+                              progress_stream=sys.stderr if args.watch else sys.stdout)
+    scanner.load_snapshot(args.snapshot, args.max_age)
     
     # 1. 执行扫描
     scanner.scan(target_ip)
+    scanner.save_snapshot(args.snapshot)
+
+    if args.watch:
+        sys.stderr.write(f"\r\033[K开始监控 {len(scanner.nodes)} 个节点，间隔 {args.interval}s\n")
+        try:
+            TopologyWatcher(scanner, interval=args.interval).run()
+        except KeyboardInterrupt:
+            pass
+        return
     
     # 2. 终端可视化输出 (Human Readable)
     scanner.render_terminal()
+    if args.hotspots > 0:
+        scanner.render_hotspots(args.hotspots)
 
     # 3. JSON 输出 (Machine Readable)
     # 打印分隔符，方便后续程序通过 awk/sed 截取，或者直接重定向
@@ -247,4 +803,4 @@ def main():
     print(f"{TermColors.GREY}{'-'*20} JSON DATA END {'-'*20}{TermColors.ENDC}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
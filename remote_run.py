@@ -3,16 +3,27 @@
 从 ssh.py 的 run_ssh 链路提取，去掉了 paramiko / pymysql 等依赖，仅依赖标准库，
 兼容 Python 3.7+。底层仍是调用本地 ssh 客户端，凭据走本地当前用户的默认方式
 （免密登录，依赖 ~/.ssh 或 agent）。
+
+命令行用法（并发在多台主机上执行，按输出内容分组汇总）：
+  python3 remote_run.py -f gen_conf/in -c 'hostname' --forks 50
+  python3 remote_run.py -H 192.168.0.10,192.168.0.11 -s ./check.sh --sudo
 """
 
+import argparse
 import fcntl
 import getpass
+import hashlib
+import json
 import os
 import selectors
 import shlex
 import subprocess
+import sys
 import time
-from typing import Optional, Tuple, Union
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import asdict, dataclass
+from typing import IO, Dict, Iterable, Iterator, List, Optional, Tuple, Union
 
 CURRENT_USER = getpass.getuser()
 
@@ -63,8 +74,61 @@ def _build_command(binary, *other_args, port=22, user=CURRENT_USER,
     return b_command
 
 
-def _bare_run(cmd, env=None, logger=None, timeout=None) -> Tuple[int, str]:
-    """启动命令并读取其 stdout/stderr 直到结束。"""
+# 每次向 ssh 进程 stdin 写入的最大字节数
+STDIN_CHUNK_SIZE = 64 * 1024
+
+StdinType = Union[None, str, bytes, IO, Iterable[Union[str, bytes]]]
+
+
+def _iter_stdin(stdin: StdinType) -> Iterator[bytes]:
+    """将 bytes / str / 文件对象 / 可迭代对象统一为按块产出 bytes 的迭代器。
+
+    文件对象按 STDIN_CHUNK_SIZE 惰性读取，不会一次性读入内存。空块直接跳过，
+    调用方据此可以把迭代器耗尽当作输入结束。
+    """
+    if isinstance(stdin, (str, bytes)):
+        if stdin:
+            yield _to_bytes(stdin)
+    elif hasattr(stdin, 'read'):
+        while True:
+            chunk = stdin.read(STDIN_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield _to_bytes(chunk)
+    else:
+        for chunk in stdin:
+            if chunk:
+                yield _to_bytes(chunk)
+
+
+class _Capture(object):
+    """累积子进程某一路输出；设置 limit 时超出部分丢弃并标记 truncated。"""
+
+    def __init__(self, limit: Optional[int] = None):
+        self.data = bytearray()
+        self.limit = limit
+        self.truncated = False
+
+    def feed(self, b_chunk: bytes):
+        if self.limit is not None:
+            room = self.limit - len(self.data)
+            if len(b_chunk) > room:
+                self.truncated = True
+                b_chunk = b_chunk[:max(room, 0)]
+        self.data += b_chunk
+
+
+def _communicate(cmd, stdout_sinks, stderr_sinks, env=None, logger=None,
+                 timeout=None, stdin: StdinType = None) -> int:
+    """启动命令，把 stdout/stderr 分别喂给对应的 _Capture，直到进程结束。
+
+    stdin 不为空时，在读取输出的同一个 select 循环里以非阻塞方式写入子进程 stdin：
+    只有管道可写时才写，且当前块写完才从数据源取下一块，
+    远端消费慢时自然形成背压，不会把整个数据源读进内存。写完后关闭 stdin 发送 EOF。
+
+    Returns:
+        子进程返回码。
+    """
     if logger:
         logger.debug(cmd)
     if env:
@@ -74,7 +138,6 @@ def _bare_run(cmd, env=None, logger=None, timeout=None) -> Tuple[int, str]:
     start_time = time.time()
     p = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
                          stderr=subprocess.PIPE, env=env)
-    b_output = b_stdout = b_stderr = b''
 
     select_timeout = 4
     for fd in (p.stdout, p.stderr):
@@ -83,6 +146,21 @@ def _bare_run(cmd, env=None, logger=None, timeout=None) -> Tuple[int, str]:
     selector = selectors.DefaultSelector()
     selector.register(p.stdout, selectors.EVENT_READ)
     selector.register(p.stderr, selectors.EVENT_READ)
+
+    stdin_chunks = None
+    b_pending = memoryview(b'')
+    if stdin is not None:
+        stdin_chunks = _iter_stdin(stdin)
+        fcntl.fcntl(p.stdin, fcntl.F_SETFL, fcntl.fcntl(p.stdin, fcntl.F_GETFL) | os.O_NONBLOCK)
+        selector.register(p.stdin, selectors.EVENT_WRITE)
+
+    def _close_stdin():
+        selector.unregister(p.stdin)
+        try:
+            p.stdin.close()
+        except BrokenPipeError:
+            pass
+
     try:
         while True:
             if timeout is not None and time.time() - start_time > timeout:
@@ -92,13 +170,32 @@ def _bare_run(cmd, env=None, logger=None, timeout=None) -> Tuple[int, str]:
             poll = p.poll()
             events = selector.select(select_timeout)
             for key, event in events:
-                if key.fileobj == p.stdout:
+                if key.fileobj == p.stdin:
+                    if not b_pending:
+                        chunk = next(stdin_chunks, None)
+                        if chunk is None:
+                            # 数据源已耗尽，关闭 stdin 让远端读到 EOF
+                            _close_stdin()
+                            continue
+                        b_pending = memoryview(chunk)
+                    try:
+                        n = os.write(p.stdin.fileno(), b_pending[:STDIN_CHUNK_SIZE])
+                    except BlockingIOError:
+                        continue
+                    except BrokenPipeError:
+                        # 远端已不再读取 stdin（命令退出或主动关闭），丢弃剩余数据
+                        if logger:
+                            logger.warning('remote stdin closed, discard remaining input')
+                        _close_stdin()
+                        continue
+                    b_pending = b_pending[n:]
+                elif key.fileobj == p.stdout:
                     b_chunk = p.stdout.read()
                     if b_chunk == b'':
                         selector.unregister(p.stdout)
                         select_timeout = 1
-                    b_output += b_chunk
-                    b_stdout += b_chunk
+                    for sink in stdout_sinks:
+                        sink.feed(b_chunk)
                     if logger and b_chunk:
                         try:
                             for line in _to_str(b_chunk).rstrip().split('\n'):
@@ -115,8 +212,8 @@ def _bare_run(cmd, env=None, logger=None, timeout=None) -> Tuple[int, str]:
                         if logger:
                             logger.warning(_to_str(b_chunk).rstrip())
                         continue
-                    b_output += b_chunk
-                    b_stderr += b_chunk
+                    for sink in stderr_sinks:
+                        sink.feed(b_chunk)
                     if logger and b_chunk:
                         try:
                             for line in _to_str(b_chunk).rstrip().split('\n'):
@@ -134,26 +231,54 @@ def _bare_run(cmd, env=None, logger=None, timeout=None) -> Tuple[int, str]:
                 break
     finally:
         selector.close()
+        if stdin is not None and not p.stdin.closed:
+            try:
+                p.stdin.close()
+            except BrokenPipeError:
+                pass
         p.stdout.close()
         p.stderr.close()
+    return p.returncode
 
-    if p.returncode == 255 and not b_stdout:
-        raise ConnectionError(_to_str(b_stderr))
-    return p.returncode, _to_str(b_output)
+
+def _bare_run(cmd, env=None, logger=None, timeout=None,
+              stdin: StdinType = None) -> Tuple[int, str]:
+    """启动命令并读取其 stdout/stderr 直到结束，返回合并后的输出。"""
+    output, stdout, stderr = _Capture(), _Capture(), _Capture()
+    returncode = _communicate(cmd, (output, stdout), (output, stderr), env=env,
+                              logger=logger, timeout=timeout, stdin=stdin)
+    if returncode == 255 and not stdout.data:
+        raise ConnectionError(_to_str(bytes(stderr.data)))
+    return returncode, _to_str(bytes(output.data))
 
 
 def _run(binary, args, port=22, user=CURRENT_USER, control_master=True,
-         logger=None, timeout=None) -> Tuple[int, str]:
+         logger=None, timeout=None, stdin: StdinType = None) -> Tuple[int, str]:
     """构造 ssh/scp 命令并执行。"""
     cmd = _build_command(binary, *args, port=port, user=user,
                          control_master=control_master)
-    return _bare_run(cmd, logger=logger, timeout=timeout)
+    return _bare_run(cmd, logger=logger, timeout=timeout, stdin=stdin)
+
+
+def _wrap_remote_cmd(cmd: str, user: str, sudo: bool, env: Optional[dict],
+                     with_stdin: bool) -> str:
+    """按 env / sudo 参数包装远程执行的 shell 命令。"""
+    if env:
+        cmd = 'export %s\n%s' % (' '.join('%s=%s' % (k, shlex.quote(v)) for k, v in env.items()), cmd)
+    if sudo and user != 'root':
+        if not with_stdin:
+            cmd = 'sudo -s <<"ssh_EOF"\n%s\nssh_EOF' % cmd
+        else:
+            # heredoc 会占用 shell 的 stdin，传入 stdin 时改用 bash -c，保证数据能到达命令
+            cmd = 'sudo bash -c %s' % shlex.quote(cmd)
+    return cmd
 
 
 def run_remote(cmd: str, host: str, port: int = 22, user: str = CURRENT_USER,
                sudo: bool = False, control_master: bool = True,
                env: Optional[dict] = None, logger=None,
-               timeout: Optional[int] = None) -> Tuple[int, str]:
+               timeout: Optional[int] = None,
+               stdin: StdinType = None) -> Tuple[int, str]:
     """在远程主机上执行 shell 命令。
 
     Args:
@@ -166,6 +291,9 @@ def run_remote(cmd: str, host: str, port: int = 22, user: str = CURRENT_USER,
         env: 要在远程 session 设置的环境变量。
         logger: 可选的 logging.Logger，用于记录命令与输出。
         timeout: 超时秒数；由于 select 机制，实际可能有约 4s 偏差。
+        stdin: 流式写入远程命令 stdin 的数据，支持 bytes/str、文件对象
+            （以二进制打开更佳）或产出 bytes/str 的迭代器，例如
+            ``run_remote('mysql test', host, stdin=open('dump.sql', 'rb'))``。
 
     Returns:
         (return_code, output)，output 为 stdout 与 stderr 合并的文本。
@@ -174,14 +302,76 @@ def run_remote(cmd: str, host: str, port: int = 22, user: str = CURRENT_USER,
         subprocess.TimeoutExpired: 执行超时。
         ConnectionError: ssh 连接失败（255 且无 stdout）。
     """
-    if env:
-        cmd = 'export %s\n%s' % (' '.join('%s=%s' % (k, shlex.quote(v)) for k, v in env.items()), cmd)
-    if sudo and user != 'root':
-        cmd = 'sudo -s <<"ssh_EOF"\n%s\nssh_EOF' % cmd
+    cmd = _wrap_remote_cmd(cmd, user, sudo, env, stdin is not None)
     args = (host, cmd)
     if logger:
         logger.info('execute command on %s:\n%s' % (host, cmd))
-    return _run('ssh', args, port, user, control_master, logger, timeout=timeout)
+    return _run('ssh', args, port, user, control_master, logger, timeout=timeout, stdin=stdin)
+
+
+@dataclass
+class RemoteResult:
+    """单台主机的结构化执行结果，stdout 与 stderr 分开保存。
+
+    error 记录命令本身之外的失败（ssh 连接失败、超时），此时 returncode
+    可能为 None；命令正常执行完毕时 error 为 None。
+    """
+    host: str
+    returncode: Optional[int] = None
+    stdout: str = ''
+    stderr: str = ''
+    start_time: float = 0.0
+    end_time: float = 0.0
+    stdout_truncated: bool = False
+    stderr_truncated: bool = False
+    error: Optional[str] = None
+
+    @property
+    def duration(self) -> float:
+        return self.end_time - self.start_time
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and self.returncode == 0
+
+    def to_dict(self) -> dict:
+        d = asdict(self)
+        d['duration'] = round(self.duration, 3)
+        return d
+
+
+def run_remote_result(cmd: str, host: str, port: int = 22, user: str = CURRENT_USER,
+                      sudo: bool = False, control_master: bool = True,
+                      env: Optional[dict] = None, logger=None,
+                      timeout: Optional[int] = None, stdin: StdinType = None,
+                      max_output: Optional[int] = None) -> RemoteResult:
+    """与 run_remote 相同的执行方式，但返回 RemoteResult 且不抛出连接/超时异常。
+
+    Args:
+        max_output: stdout、stderr 各自最多保留的字节数，超出部分丢弃并置
+            stdout_truncated / stderr_truncated；None 表示不限制。
+        其余参数同 run_remote。
+    """
+    wrapped = _wrap_remote_cmd(cmd, user, sudo, env, stdin is not None)
+    if logger:
+        logger.info('execute command on %s:\n%s' % (host, wrapped))
+    ssh_cmd = _build_command('ssh', host, wrapped, port=port, user=user,
+                             control_master=control_master)
+    stdout, stderr = _Capture(max_output), _Capture(max_output)
+    result = RemoteResult(host=host, start_time=time.time())
+    try:
+        result.returncode = _communicate(ssh_cmd, (stdout,), (stderr,), logger=logger,
+                                         timeout=timeout, stdin=stdin)
+    except subprocess.TimeoutExpired as e:
+        result.error = 'timeout after %ss' % e.timeout
+    result.end_time = time.time()
+    result.stdout = bytes(stdout.data).decode('utf-8', 'replace')
+    result.stderr = bytes(stderr.data).decode('utf-8', 'replace')
+    result.stdout_truncated = stdout.truncated
+    result.stderr_truncated = stderr.truncated
+    if result.returncode == 255 and not stdout.data:
+        result.error = 'ssh connect failed: %s' % result.stderr.strip()
+    return result
 
 
 def run_local(cmd: str, env: Optional[dict] = None, logger=None,
@@ -225,27 +415,172 @@ def run_local(cmd: str, env: Optional[dict] = None, logger=None,
     return p.returncode, b_output.decode('utf-8', 'replace')
 
 
+def load_hosts(path: str, groups: Optional[List[str]] = None) -> List[str]:
+    """读取主机清单文件，返回去重后保持原顺序的主机列表。
+
+    兼容两种格式，可混用：
+      - 每行一个 IP；
+      - gen_conf/in 格式：``db ip ip ip``，首列为库名。
+    空行与 # 开头的行忽略。groups 不为空时只保留这些库名下的主机。
+    """
+    hosts = OrderedDict()
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            s = line.strip()
+            if not s or s.startswith('#'):
+                continue
+            parts = s.split()
+            if len(parts) == 1:
+                group, ips = None, parts
+            else:
+                group, ips = parts[0], parts[1:]
+            if groups and group not in groups:
+                continue
+            for ip in ips:
+                hosts[ip] = None
+    return list(hosts)
+
+
+def run_many(cmd: str, hosts: List[str], forks: int = 10, **kwargs) -> Dict[str, Tuple[int, str]]:
+    """以 forks 个并发在多台主机上执行同一命令。
+
+    kwargs 透传给 run_remote。ssh 连接失败、超时等异常不会中断其他主机，
+    以 (255, 错误信息) / (-1, 错误信息) 的形式记录在结果中。
+
+    Returns:
+        {host: (return_code, output)}，按 hosts 原顺序排列。
+    """
+    def _one(host):
+        try:
+            return run_remote(cmd, host, **kwargs)
+        except ConnectionError as e:
+            return 255, 'ssh connect failed: %s' % str(e).strip()
+        except subprocess.TimeoutExpired as e:
+            return -1, 'timeout after %ss' % e.timeout
+
+    with ThreadPoolExecutor(max_workers=max(1, forks)) as pool:
+        results = pool.map(_one, hosts)
+        return OrderedDict(zip(hosts, results))
+
+
+def iter_results(cmd: str, hosts: List[str], forks: int = 10, **kwargs) -> Iterator[RemoteResult]:
+    """以 forks 个并发执行，按完成先后逐个产出 RemoteResult。
+
+    kwargs 透传给 run_remote_result。调用方可以边产出边处理/落盘，
+    不必等全部主机执行完，也不必把所有输出同时留在内存里。
+
+    同时在途的任务不超过 forks 个（滑动窗口），结果产出后即丢弃对应的 future，
+    内存中最多只保留 forks 份输出。
+    """
+    forks = max(1, forks)
+    pending_hosts = iter(hosts)
+    with ThreadPoolExecutor(max_workers=forks) as pool:
+        in_flight = set()
+        for host in pending_hosts:
+            in_flight.add(pool.submit(run_remote_result, cmd, host, **kwargs))
+            if len(in_flight) >= forks:
+                break
+        while in_flight:
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                host = next(pending_hosts, None)
+                if host is not None:
+                    in_flight.add(pool.submit(run_remote_result, cmd, host, **kwargs))
+            for future in done:
+                yield future.result()
+
+
+def write_jsonl(results: Iterable[RemoteResult], out=sys.stdout) -> int:
+    """把结果逐条写成 JSON lines（每行一个 RemoteResult.to_dict()），每条写完即 flush。
+
+    Returns:
+        非 ok 的结果数。
+    """
+    failed = 0
+    for result in results:
+        out.write(json.dumps(result.to_dict(), ensure_ascii=False) + '\n')
+        out.flush()
+        if not result.ok:
+            failed += 1
+    return failed
+
+
+def group_results(results: Dict[str, Tuple[int, str]]) -> List[Tuple[str, int, str, List[str]]]:
+    """按 (return_code, output) 的内容哈希对结果分组。
+
+    Returns:
+        [(digest, return_code, output, [host, ...]), ...]，按主机数降序。
+    """
+    groups = OrderedDict()
+    for host, (code, output) in results.items():
+        digest = hashlib.sha1(b'%d\0' % code + _to_bytes(output)).hexdigest()[:12]
+        if digest not in groups:
+            groups[digest] = (code, output, [])
+        groups[digest][2].append(host)
+    return sorted(((d, c, o, h) for d, (c, o, h) in groups.items()),
+                  key=lambda g: len(g[3]), reverse=True)
+
+
+def print_groups(groups, total: int, out=sys.stdout):
+    """打印分组汇总：每组先给出主机数与哈希，再给出主机列表和输出内容。"""
+    out.write('%d hosts, %d distinct results\n' % (total, len(groups)))
+    for digest, code, output, hosts in groups:
+        out.write('\n==== %d hosts returned [%s] rc=%d ====\n' % (len(hosts), digest, code))
+        out.write('hosts: %s\n' % ' '.join(hosts))
+        out.write(output if output.endswith('\n') or not output else output + '\n')
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description='在多台主机上并发执行命令或脚本，并按输出分组汇总')
+    src = p.add_mutually_exclusive_group(required=True)
+    src.add_argument('-f', '--hosts-file', help='主机清单文件：每行一个 IP，或 gen_conf/in 格式 "db ip ip ip"')
+    src.add_argument('-H', '--hosts', help='逗号分隔的主机列表')
+    p.add_argument('-g', '--group', action='append',
+                   help='只执行清单中指定库名下的主机，可重复指定')
+    what = p.add_mutually_exclusive_group(required=True)
+    what.add_argument('-c', '--command', help='要执行的 shell 命令')
+    what.add_argument('-s', '--script', help='本地脚本路径，内容整体作为命令发送到远程执行')
+    p.add_argument('--forks', type=int, default=10, help='并发数，默认 10')
+    p.add_argument('--sudo', action='store_true', help='以 sudo 方式执行')
+    p.add_argument('--user', default=CURRENT_USER, help='ssh 登录用户，默认本地当前用户')
+    p.add_argument('--port', type=int, default=22, help='ssh 端口，默认 22')
+    p.add_argument('--timeout', type=int, help='单台主机超时秒数')
+    p.add_argument('--jsonl', action='store_true',
+                   help='按完成顺序逐行输出 JSON 结果（stdout/stderr 分开），不做分组汇总')
+    p.add_argument('--max-output', type=int, default=1024 * 1024,
+                   help='--jsonl 模式下 stdout/stderr 各自保留的最大字节数，默认 1MB')
+    return p.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.hosts_file:
+        hosts = load_hosts(args.hosts_file, args.group)
+    else:
+        hosts = list(OrderedDict.fromkeys(h.strip() for h in args.hosts.split(',') if h.strip()))
+    if not hosts:
+        print('没有可执行的主机', file=sys.stderr)
+        sys.exit(2)
+
+    if args.script:
+        # sudo 路径下 run_remote 已用 <<ssh_EOF 包裹，脚本里的 heredoc 定界符不能再用 ssh_EOF
+        with open(args.script, encoding='utf-8') as f:
+            cmd = f.read()
+    else:
+        cmd = args.command
+
+    if args.jsonl:
+        failed = write_jsonl(iter_results(cmd, hosts, forks=args.forks, port=args.port, user=args.user,
+                                          sudo=args.sudo, timeout=args.timeout,
+                                          max_output=args.max_output))
+        sys.exit(1 if failed else 0)
+
+    results = run_many(cmd, hosts, forks=args.forks, port=args.port, user=args.user,
+                       sudo=args.sudo, timeout=args.timeout)
+    print_groups(group_results(results), len(hosts))
+    # 任一主机失败时返回非 0，方便在 cron / 流水线中判断
+    sys.exit(0 if all(code == 0 for code, _ in results.values()) else 1)
+
+
 if __name__ == '__main__':
-    host = '192.168.0.10'
-
-    # 用法一：单条命令
-    code, output = run_remote('hostname', host, sudo=True)
-    print('return code:', code)
-    print('hostname:', output.strip())
-
-    # 用法二：把整段脚本内容（含 heredoc）直接写在 Python 调用里
-    # 注意：sudo 路径下 run_remote 已用 <<ssh_EOF 包裹，脚本里的 heredoc 定界符
-    # 不能再用 ssh_EOF，这里用 SCRIPT_EOF 避免冲突。
-    script = """\
-set -e
-cat > /tmp/hello.sh <<'SCRIPT_EOF'
-#!/bin/bash
-echo "hello from $(hostname)"
-echo "now: $(date '+%F %T')"
-SCRIPT_EOF
-chmod +x /tmp/hello.sh
-/tmp/hello.sh
-"""
-    code, output = run_remote(script, host, sudo=True)
-    print('return code:', code)
-    print('script output:', output.strip())
+    main()
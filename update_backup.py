@@ -1,18 +1,15 @@
 #!/usr/bin/env python3
+import atexit
 import os
 import re
-
-# 设置环境变量使用纯Python解析protocol buffers（速度较慢但兼容性好）
-os.environ["PROTOCOL_BUFFERS_PYTHON_IMPLEMENTATION"] = "python"
-
 import argparse
 import pymysql
-import etcd3
-import json
 import sys
-from typing import Set, Dict, Any
+from typing import Set, Dict, Any, Tuple
 import jinja2
 
+from ha_meta import DEFAULT_BACKEND, HaBackend, HaIndex, HaMetaError, open_backend
+
 # Database configuration
 MYSQL_CONFIG = {
     "host": "192.168.0.10",
@@ -27,10 +24,6 @@ idc_map = {
     "p3": "192.168.252",
 }
 
-# etcd configuration
-ETCD_HOST = "127.0.0.1"
-ETCD_PORT = 2379
-
 
 def get_idc(ip: str) -> str:
     return "p1"
@@ -115,34 +108,46 @@ WHERE
         sys.exit(1)
 
 
-def get_etcd_ha(vip: str) -> Set[str]:
-    "获取etcd中的ha信息"
+_ha_backends: Dict[str, HaBackend] = {}
+_ha_indexes: Dict[Tuple[str, str], HaIndex] = {}
+
+
+def get_ha_index(etcd_path: str, backend_spec: str = DEFAULT_BACKEND, watch: bool = False) -> HaIndex:
+    """同一进程内按 (后端, 前缀) 复用索引，批量解析多个 vip 时不再为每个 vip 重新扫描整个前缀。
+
+    默认每次查找前做一次轻量的 prefix_version 检查；长期运行、反复查找的调用方可传 watch=True，
+    由 etcd watch 增量更新索引（退出时自动取消）。
+    """
+    backend = _ha_backends.get(backend_spec)
+    if backend is None:
+        backend = _ha_backends[backend_spec] = open_backend(backend_spec)
+    index = _ha_indexes.get((backend_spec, etcd_path))
+    if index is None:
+        index = _ha_indexes[(backend_spec, etcd_path)] = HaIndex(backend, etcd_path, watch=watch)
+    return index
+
+
+@atexit.register
+def close_ha_indexes():
+    """退出时取消所有 watch"""
+    for index in _ha_indexes.values():
+        index.close()
+    _ha_indexes.clear()
+
+
+def get_etcd_ha(vip: str, backend_spec: str = DEFAULT_BACKEND) -> Set[str]:
+    "获取etcd中的ha信息，backend_spec 为 HA 元数据后端（etcd://、http://、file://），见 ha_meta.py"
     ip_prefix2 = ".".join(vip.split(".")[:1])
     # 通过vip获取仲裁前缀ip段后查询该仲裁下的所有ha信息
     arbit_prefix = idc_map.get(get_idc(vip))
     etcd_path = f"/db/ha/arbit/{arbit_prefix}"
     try:
-        # get all etcd keys and values under the specified path recursively
-        etcd = etcd3.client(host=ETCD_HOST, port=ETCD_PORT)
-        for value, metadata in etcd.get_prefix(etcd_path):
-            if value:
-                try:
-                    data = json.loads(value.decode("utf-8"))
-                    etcd_vip = data.get("vip")
-                    if vip == etcd_vip:
-                        return data
-                except json.JSONDecodeError as err:
-                    print(
-                        f"JSON Parse Error for key {metadata.key.decode('utf-8')}: {err}"
-                    )
-        return None
-
-    except etcd3.exceptions.Etcd3Exception as err:
+        return get_ha_index(etcd_path, backend_spec).get(vip)
+
+    except HaMetaError as err:
         print(f"etcd Error: {err}")
         sys.exit(1)
-    except json.JSONDecodeError as err:
-        print(f"JSON Parse Error: {err}")
-        sys.exit(1)
+
 
 def gen_template(db_ips, ha_ips):
     ip_new = list(db_ips - ha_ips)
@@ -174,6 +179,8 @@ def main():
         description="生成更新备份列表"
     )
     parser.add_argument("ip", help="要调整集群的IP地址")
+    parser.add_argument("--ha-backend", default=DEFAULT_BACKEND,
+                        help=f"HA 元数据后端（etcd://、http://、file://），默认 {DEFAULT_BACKEND}")
     args = parser.parse_args()
 
     print(f"查询IP: {args.ip}")
@@ -187,7 +194,7 @@ def main():
     print(f"IP列表: {mysql_ips}")
 
     # Step 3: Get IPs from etcd
-    etcd_ips = get_etcd_ha(vip)
+    etcd_ips = get_etcd_ha(vip, args.ha_backend)
     print(f"etcd IP列表: {etcd_ips}")
 
     # Step 4: Compute difference
@@ -201,7 +208,7 @@ def main():
     # get_vip_from_ip("192.168.0.1")
     cluster_ips = get_cluster_ips("192.168.0.1")
     vip = get_vip_from_ip("192.168.0.1")
-    ha = get_etcd_ha(vip)
+    ha = get_etcd_ha(vip, args.ha_backend)
     ha_ips = {ha["master"], ha["slave"]} if ha else set()
     gen_template(cluster_ips, ha_ips)
     # print(cluster_ips)